@@ -1,20 +1,24 @@
-import os
+import json
+import time
+from concurrent.futures import TimeoutError
+from functools import cached_property, lru_cache
 
-from langchain_core.messages import AIMessage
+import tiktoken
+
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from langchain_core.tools import tool
-from langgraph.checkpoint.memory import MemorySaver
 
-from langgraph.prebuilt import ToolNode
 from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph, MessagesState, START, END, add_messages
+from langgraph.graph import StateGraph, START, END, add_messages
 
 from typing import TypedDict, Annotated, Sequence
-import operator
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage, trim_messages, BaseMessage
 
+from app.answer_cache import answer_cache
+from app.checkpointer import create_checkpointer
 from app.core.config import settings
-from app.query_relation_db import RelationDB
-from app.rag import RAG
+from app.embeddings import embeddings
+from app.tool_registry import tool_registry
 from loguru import logger
 
 
@@ -26,8 +30,17 @@ enabling dynamic knowledge retrieval before generating responses. \
 It queries a specified knowledge base (documents) and returns relevant context to improve accuracy and relevance in AI-generated outputs. \
 Ideal for handling complex queries, knowledge-intensive tasks, and real-time updates.\
     """
-    rag = RAG()
-    result = rag.graph.invoke({"question": question, "space_id": space_id})
+    question_vector = embeddings.embed_query_vectors([question])[0]
+    answer = answer_cache.get(space_id, question_vector)
+    if answer is not None:
+        return answer
+
+    generation = answer_cache.generation(space_id)
+    with tool_registry.call("rag") as rag:
+        result = rag.graph.invoke({"question": question, "space_id": space_id})
+    # Answers without context come from retrieval errors or empty spaces, they are not cached
+    if result["context"]:
+        answer_cache.put(space_id, question_vector, result["answer"], generation)
     return result["answer"]
 
 @tool
@@ -37,20 +50,36 @@ def get_sql(question: str):
 It allows querying workspace and space metadata, such as last updated timestamps, document counts, and other relevant attributes, \
 ensuring precise and efficient data access.\
     """
-    rdb = RelationDB()
-    result = rdb.graph.invoke({"question": question})
+    with tool_registry.call("sql") as rdb:
+        result = rdb.graph.invoke({"question": question})
     if "answer" in result:
         return result["answer"]
     else:
         return "I don't know"
 
 
+@lru_cache(maxsize=None)
+def get_encoding():
+    # Tokenizer of gpt-4o-mini
+    return tiktoken.encoding_for_model("gpt-4o-mini")
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """Tokens of a message in the prompt: its content, its tool calls and the chat format overhead."""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    tokens = 3 + len(get_encoding().encode_ordinary(content))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += len(get_encoding().encode_ordinary(call["name"] + json.dumps(call["args"])))
+    return tokens
+
+
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    token_counts: dict  # message id -> tokens of the messages in the state, counted once per message
 
 
 class Agent:
-    def __init__(self, tools, system):
+    def __init__(self, tools, system, checkpointer=None):
         self.system = system
         graph = StateGraph(AgentState)
         graph.add_node("llm", self.call_openai)
@@ -63,22 +92,22 @@ class Agent:
         )
         graph.add_edge("action", "llm")
         graph.set_entry_point("llm")
-        memory = MemorySaver()
+        # Conversation history per thread_id, persisted in CHECKPOINT_DB
+        self.checkpointer = checkpointer or create_checkpointer()
 
-        self.graph = graph.compile(checkpointer=memory)
+        self.graph = graph.compile(checkpointer=self.checkpointer)
 
         self.tools = {t.name: t for t in tools}
+        # Shared by every conversation, copies the caller's context for tracing
+        self.executor = ContextThreadPoolExecutor(max_workers=settings.TOOL_WORKERS, thread_name_prefix="tool")
         model = ChatOpenAI(model="gpt-4o-mini", temperature=0.6)
         self.model = model.bind_tools(tools)
 
-        self.trimmer = trim_messages(
-            token_counter=len,
-            max_tokens=10,
-            strategy="last",
-            include_system=True,
-            allow_partial=False,
-            start_on="human",
-        )
+        self.system_message = SystemMessage(content=system, id="system") if system else None
+
+    @cached_property
+    def system_tokens(self) -> int:
+        return count_message_tokens(self.system_message) if self.system else 0
 
     def exists_action(self, state: AgentState):
         result = state['messages'][-1]
@@ -86,32 +115,92 @@ class Agent:
 
     def call_openai(self, state: AgentState):
         messages = state['messages']
+        counts = state.get('token_counts') or {}
+        # Only the messages added since the last turn are tokenized, counts of removed messages are dropped
+        new_counts = {m.id: counts[m.id] if m.id in counts else count_message_tokens(m) for m in messages}
         if self.system:
-            messages = [SystemMessage(content=self.system)] + messages
+            messages = [self.system_message] + messages
 
         logger.info("Start trim messages")
-        trimmed_messages = self.trimmer.invoke(messages)
+        trimmed_messages = self.trim(messages, new_counts)
         logger.info("Start model invoke")
 
         message = self.model.invoke(trimmed_messages)
-        return {'messages': [message]}
+        return {'messages': [message], 'token_counts': new_counts}
+
+    def trim(self, messages: list, counts: dict) -> list:
+        """Last messages fitting in HISTORY_MAX_TOKENS, starting on a human message, with the system prompt.
+
+        The current turn, from the last human message, is kept even when it alone is over the budget.
+        """
+        def token_counter(batch: Sequence[BaseMessage]) -> int:
+            return sum(self.system_tokens if m is self.system_message else counts[m.id] for m in batch)
+
+        trimmed = trim_messages(
+            messages,
+            token_counter=token_counter,
+            max_tokens=settings.HISTORY_MAX_TOKENS,
+            strategy="last",
+            include_system=True,
+            allow_partial=False,
+            start_on="human",
+        )
+        if trimmed and trimmed[-1].id == messages[-1].id and any(isinstance(m, HumanMessage) for m in trimmed):
+            return trimmed
+        history = messages[1:] if self.system else messages
+        last_human = max((i for i, m in enumerate(history) if isinstance(m, HumanMessage)), default=0)
+        logger.warning(f"The current turn is over HISTORY_MAX_TOKENS ({token_counter(history[last_human:])} tokens)")
+        return messages[:len(messages) - len(history)] + history[last_human:]
 
     def take_action(self, state: AgentState):
+        """Runs the tool calls of the last message concurrently, their results keep the order of the calls."""
         tool_calls = state['messages'][-1].tool_calls
-        results = []
+        calls = []
         for t in tool_calls:
             logger.info(f"Calling: {t}")
-            if not t['name'] in self.tools:      # check for bad tool name from LLM
-                logger.info("\n ....bad tool name....")
-                result = "bad tool name, retry"  # instruct LLM to retry if bad
-            else:
-                result = self.tools[t['name']].invoke(t['args'])
+            started = []
+            calls.append((t, started, self.executor.submit(self.run_tool, t, started)))
+        results = []
+        for t, started, future in calls:
+            result = self.wait(t, started, future)
             logger.info(f"Result: {result}")
-
             results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
         logger.info("Back to the model!")
         return {'messages': results}
 
+    def run_tool(self, t: dict, started: list):
+        started.append(time.perf_counter())
+        if not t['name'] in self.tools:      # check for bad tool name from LLM
+            logger.info("\n ....bad tool name....")
+            return "bad tool name, retry"  # instruct LLM to retry if bad
+        try:
+            result = self.tools[t['name']].invoke(t['args'])
+        except Exception as e:
+            tool_registry.record(t['name'], "error", time.perf_counter() - started[0])
+            logger.error(f"Tool {t['name']} failed: {e}")
+            return f"Error: {e}"
+        tool_registry.record(t['name'], "ok", time.perf_counter() - started[0])
+        return result
+
+    def wait(self, t: dict, started: list, future):
+        """Result of a tool call, or a timeout message TOOL_TIMEOUT seconds after the call started running."""
+        begin = started[0] if started else time.perf_counter()
+        try:
+            return future.result(timeout=max(0.0, begin + settings.TOOL_TIMEOUT - time.perf_counter()))
+        except TimeoutError:
+            pass
+        # Calls queued behind other ones get their own TOOL_TIMEOUT once they run
+        if started or not future.cancel():
+            remaining = (started[0] if started else time.perf_counter()) + settings.TOOL_TIMEOUT - time.perf_counter()
+            try:
+                return future.result(timeout=max(0.0, remaining))
+            except TimeoutError:
+                pass
+        elapsed = time.perf_counter() - started[0] if started else settings.TOOL_TIMEOUT
+        tool_registry.record(t['name'], "timeout")
+        logger.error(f"Tool {t['name']} timed out after {elapsed:.1f} s")
+        return f"{t['name']} timed out after {settings.TOOL_TIMEOUT:g} s"
+
 
 prompt = """
 You are an intelligent assistant with access to multiple tools to retrieve and process information efficiently. Your goal is to provide accurate, relevant, and concise responses based on the user's query. 
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+
+class AnswerCache:
+    """Semantic cache of RAG answers, keyed by space and question embedding.
+
+    A question hits when the cosine similarity with a cached question of the same space
+    reaches the threshold. Entries expire after ttl seconds, the least recently used are
+    dropped beyond max_entries, and a space is emptied whenever its documents change.
+    The cache lives in process memory, so documents changed by another process (e.g. the
+    bulk ingestion CLI) are only picked up once the entries expire.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (space_id, n) -> (normalized vector, answer, expires_at)
+        self.spaces = {}  # space_id -> keys of its entries
+        self.generations = {}  # space_id -> number of invalidations
+        self.counter = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def generation(self, space_id: int) -> int:
+        """Version of the documents of a space, to be passed back to put."""
+        with self.lock:
+            return self.generations.get(space_id, 0)
+
+    def get(self, space_id: int, vector) -> Optional[str]:
+        """Returns the answer of the most similar cached question of the space, if similar enough."""
+        vector = self.normalize(vector)
+        now = time.time()
+        with self.lock:
+            keys = list(self.spaces.get(space_id, ()))
+            self.drop([key for key in keys if self.entries[key][2] <= now])
+            keys = [key for key in keys if key in self.entries]
+            if keys:
+                similarities = np.stack([self.entries[key][0] for key in keys]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self.entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def put(self, space_id: int, vector, answer: str, generation: int):
+        """Caches an answer, unless the documents of the space changed since generation was read."""
+        with self.lock:
+            if self.generations.get(space_id, 0) != generation:
+                return
+            self.counter += 1
+            key = (space_id, self.counter)
+            self.entries[key] = (self.normalize(vector), answer, time.time() + self.ttl)
+            self.spaces.setdefault(space_id, set()).add(key)
+            excess = len(self.entries) - self.max_entries
+            if excess > 0:
+                self.drop(list(self.entries)[:excess])
+
+    def invalidate(self, space_id: int):
+        """Forgets the answers of a space, called when a document is added to or removed from it."""
+        with self.lock:
+            self.generations[space_id] = self.generations.get(space_id, 0) + 1
+            self.drop(list(self.spaces.get(space_id, ())))
+            self.invalidations += 1
+
+    def drop(self, keys):
+        for key in keys:
+            del self.entries[key]
+            self.spaces[key[0]].discard(key)
+            if not self.spaces[key[0]]:
+                del self.spaces[key[0]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache(
+    settings.ANSWER_CACHE_THRESHOLD,
+    settings.ANSWER_CACHE_TTL,
+    settings.ANSWER_CACHE_MAX_ENTRIES,
+)
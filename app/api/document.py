@@ -1,16 +1,22 @@
 import json
 import os
 import shutil
+import tempfile
 from typing import Optional
 
-from app.contextual_vectordb import context_vectordb
+from app.answer_cache import answer_cache
+from app.bulk_ingest import BulkIngestionJob, resolve_import_dir
 from app.core.config import settings
 from app.db.document import DocumentsService
+from app.db.document_chunk import DocumentChunksService
 from app.db.space import SpacesService
+from app.ingestion import IngestionJob, ingestion_queue, store_pdf
 
 from fastapi import APIRouter, Depends, status, UploadFile, File, HTTPException, Form
 from app.schemas.document_request import DocumentRequest
+from app.schemas.bulk_ingestion_response import BulkIngestionJobResponse
 from app.schemas.document_response import DocumentResponse
+from app.schemas.ingestion_response import IngestionJobResponse
 from app.vectordb import vectordb
 from typing_extensions import Annotated
 
@@ -31,8 +37,8 @@ def parse_document_schema(document_schema: str = Form(...)) -> DocumentRequest:
 
 @router.post(
     '/upload',
-    response_model=DocumentResponse,
-    status_code=status.HTTP_201_CREATED,
+    response_model=IngestionJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
     name='Upload PDF'
 )
 def upload_pdf(
@@ -54,31 +60,182 @@ def upload_pdf(
             "workspace_id": 1,
             "space_id": 1
         }
+
+    The file is embedded in the background; poll /documents/jobs/{job_id} for progress.
+    Files that were already uploaded reuse the vectors of the first upload instead of being embedded again.
     """
     try:
 
         if file.content_type != "application/pdf":
             raise HTTPException(status_code=400, detail="Only PDF files are allowed!")
 
-        file_path = os.path.join(settings.PDF_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_path, content_hash = store_pdf(file.file)
+        source = document_service.find_document_by_hash(content_hash)
 
         document_schema.title = str(file.filename)
-        doc_obj = document_service.add_document(document_schema)
-        space_service.increase_num_documents(doc_obj.workspace_id)
+        doc_obj = document_service.add_document(document_schema, content_hash)
+        space_service.increase_num_documents(doc_obj.space_id)
+
+        return ingestion_queue.submit(
+            file_path, doc_obj.space_id, doc_obj.id, advance,
+            source_document_id=source.id if source else None,
+            source_space_id=source.space_id if source else None
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post(
+    '/bulk',
+    response_model=BulkIngestionJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    name='Bulk upload PDFs'
+)
+def bulk_upload(
+        document_schema: DocumentRequest = Depends(parse_document_schema),
+        file: Optional[UploadFile] = File(None, description="Accept: application/zip"),
+        directory: Optional[str] = Form(None, description="Directory relative to BULK_IMPORT_DIR"),
+        space_service: SpacesService = Depends(),
+        advance: bool = True,
+):
+    """
+    API Bulk upload PDFs
+
+    Requires either:
+
+        - a zip archive of pdf files
+        - a server-side directory of pdf files, relative to BULK_IMPORT_DIR
+
+    and the document_schema shared by all files (the titles are the file names).
+    The files are ingested in the background; poll /documents/bulk/{job_id} for progress.
+    """
+    if (file is None) == (directory is None):
+        raise HTTPException(status_code=400, detail="Send either a zip file or a directory")
+    space_service.get_space_by_id(document_schema.space_id)
 
-        if advance:
-            context_vectordb.embed_docs(file_path, doc_obj.space_id, doc_obj.id)
+    try:
+        if directory is not None:
+            job = BulkIngestionJob(resolve_import_dir(directory), document_schema, advance)
         else:
-            vectordb.embed_docs(file_path, doc_obj.space_id, doc_obj.id)
+            with tempfile.NamedTemporaryFile(dir=settings.PDF_DIR, suffix=".zip", delete=False) as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            job = BulkIngestionJob(buffer.name, document_schema, advance, cleanup=True)
+        return ingestion_queue.submit_job(job)
+
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        return doc_obj
+
+@router.get(
+    '/bulk/{job_id}',
+    response_model=BulkIngestionJobResponse,
+    status_code=status.HTTP_200_OK,
+    name='Get bulk ingestion job'
+)
+def get_bulk_ingestion_job(job_id: str):
+    job = ingestion_queue.get_job(job_id)
+    if not isinstance(job, BulkIngestionJob):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job
+
+
+@router.put(
+    '/{document_id}',
+    response_model=IngestionJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    name='Replace PDF'
+)
+def replace_pdf(
+        document_id: int,
+        file: Annotated[UploadFile, File(description="Accept: application/pdf")],
+        document_service: DocumentsService = Depends(),
+        advance: bool = True,
+):
+    """
+    API Replace PDF
+
+    Uploads a new revision of a document. Only the chunks whose content changed are embedded,
+    the vectors of removed chunks are deleted.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed!")
+    doc_obj = document_service.get_document_by_id(document_id)
+    if ingestion_queue.is_ingesting(document_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is being ingested"
+        )
+
+    try:
+        file_path, content_hash = store_pdf(file.file)
+        source = document_service.find_document_by_hash(content_hash)
+
+        # The title and hash of the document are updated by the job once the new revision is ingested
+        return ingestion_queue.submit(
+            file_path, doc_obj.space_id, doc_obj.id, advance,
+            source_document_id=source.id if source and source.id != doc_obj.id else None,
+            replace=True,
+            source_space_id=source.space_id if source else None,
+            title=str(file.filename),
+            content_hash=content_hash
+        )
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.delete(
+    '/{document_id}',
+    status_code=status.HTTP_204_NO_CONTENT,
+    name='Delete document'
+)
+def delete_document(
+        document_id: int,
+        document_service: DocumentsService = Depends(),
+        chunk_service: DocumentChunksService = Depends(),
+        space_service: SpacesService = Depends(),
+):
+    """Deletes a document together with all of its vectors."""
+    document = document_service.get_document_by_id(document_id)
+    if ingestion_queue.is_ingesting(document_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is being ingested"
+        )
+
+    chunk_ids = [chunk.chunk_id for chunk in chunk_service.get_chunks(document_id)]
+    if chunk_ids:
+        vectordb.delete_chunks(document.space_id, chunk_ids)
+    else:
+        vectordb.delete_document(document.space_id, document_id)
+    chunk_service.delete_chunks(document_id)
+
+    space_id = document.space_id
+    document_service.delete_document(document_id)
+    space_service.decrease_num_documents(space_id)
+    answer_cache.invalidate(space_id)
+
+
+@router.get(
+    '/jobs/{job_id}',
+    response_model=IngestionJobResponse,
+    status_code=status.HTTP_200_OK,
+    name='Get ingestion job'
+)
+def get_ingestion_job(job_id: str):
+    job = ingestion_queue.get_job(job_id)
+    if not isinstance(job, IngestionJob):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job
+
+
 @router.get(
     '/all',
     response_model=list[DocumentResponse],
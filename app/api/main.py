@@ -1,9 +1,10 @@
 from fastapi import FastAPI
 
-from app.api import user, workspace, space, document, chatbot
+from app.api import user, workspace, space, document, chatbot, metrics
 from app.core.config import settings
 from app.models.base import Base
 from app.db.base import engine
+from app.db.migrations import add_missing_columns
 
 app = FastAPI(title="RAG & SQL", version="0.1.0")
 
@@ -12,5 +13,7 @@ app.include_router(workspace.router)
 app.include_router(space.router)
 app.include_router(document.router)
 app.include_router(chatbot.router)
+app.include_router(metrics.router)
 
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, status
+
+from app.agent import agent
+from app.answer_cache import answer_cache
+from app.contextualizer import contextualizer
+from app.embeddings import embeddings
+from app.exact_search import search_stats
+from app.tool_registry import tool_registry
+
+router = APIRouter(
+    prefix='/metrics',
+    tags=['Metrics'],
+)
+
+
+@router.get(
+    '/caches',
+    status_code=status.HTTP_200_OK,
+    name='Cache statistics'
+)
+def get_cache_stats():
+    return {
+        "contextualization": contextualizer.cache.stats(),
+        "embeddings": embeddings.stats(),
+        "answers": answer_cache.stats(),
+        "conversations": agent.checkpointer.stats(),
+    }
+
+
+@router.get(
+    '/search',
+    status_code=status.HTTP_200_OK,
+    name='Search statistics'
+)
+def get_search_stats():
+    """Latency and sampled recall@k of the exact and HNSW search strategies, and latency of the text hydration."""
+    return search_stats.stats()
+
+
+@router.get(
+    '/tools',
+    status_code=status.HTTP_200_OK,
+    name='Tool statistics'
+)
+def get_tool_stats():
+    """Build time, cold first call and warm call latency of the agent tool pipelines, and latency
+    and outcomes of the tool calls of the agent."""
+    return tool_registry.stats()
@@ -1,11 +1,12 @@
 import os
 import shutil
+from itertools import islice
 
 from fastapi import APIRouter, Depends, status
 from fastapi import UploadFile, File, HTTPException
 
 from app.core.config import settings
-from app.vectordb import load_docs
+from app.pipeline import iter_pages, iter_chunks
 
 router = APIRouter(
     prefix='/vectordb',
@@ -23,8 +24,8 @@ def upload_pdf(file: UploadFile = File(...)):
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        docs = load_docs(file_path)
-        content = [page.page_content[:100] for page in docs[:3]]
+        docs = islice(iter_chunks(iter_pages(file_path, parallel=False)), 3)
+        content = [page.page_content[:100] for page in docs]
 
         return {"filename": file.filename, "content": content}
 
@@ -0,0 +1,245 @@
+import json
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+from loguru import logger
+
+from app.contextual_vectordb import context_vectordb
+from app.core.config import settings
+from app.db.document import DocumentsService
+from app.db.document_chunk import DocumentChunksService
+from app.ingestion import Job, store_pdf
+from app.pipeline import batched, parse_pdf
+from app.schemas.document_request import DocumentRequest
+from app.vectordb import vectordb
+
+# (title, stored file path, content hash)
+StoredFile = Tuple[str, str, str]
+
+
+def resolve_import_dir(directory: str) -> str:
+    """Resolves a server-side directory, which must live under BULK_IMPORT_DIR."""
+    root = os.path.realpath(settings.BULK_IMPORT_DIR)
+    path = os.path.realpath(os.path.join(root, directory))
+    if path != root and not path.startswith(root + os.sep):
+        raise ValueError(f"Directory must be inside {settings.BULK_IMPORT_DIR}")
+    if not os.path.isdir(path):
+        raise ValueError(f"Directory {directory} not found")
+    return path
+
+
+def collect_files(source: str) -> List[StoredFile]:
+    """Copies every PDF of a zip archive or a directory tree into PDF_DIR, content-addressed."""
+    files = []
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(".pdf"):
+                    continue
+                with archive.open(member) as fileobj:
+                    files.append((os.path.basename(member.filename), *store_pdf(fileobj)))
+    elif os.path.isdir(source):
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                if not name.lower().endswith(".pdf"):
+                    continue
+                with open(os.path.join(root, name), "rb") as fileobj:
+                    files.append((name, *store_pdf(fileobj)))
+    else:
+        raise ValueError(f"{source} is neither a zip archive nor a directory")
+    return files
+
+
+class BulkIngestionJob(Job):
+    """Ingests every PDF of a zip archive or a directory into one space.
+
+    Files are parsed in a process pool and all of their chunks go through a single
+    contextualize -> embed -> write pipeline. Document rows and the space counter are
+    written BULK_DB_BATCH_SIZE documents per transaction, files already uploaded reuse
+    the stored vectors of their first upload. A file that fails is removed again, its
+    document row and vectors included, and so is every document of a job that fails.
+    """
+
+    def __init__(self, source: str, document_schema: DocumentRequest, advance: bool = True, cleanup: bool = False):
+        super().__init__()
+        self.source = source
+        self.owner_id = document_schema.owner_id
+        self.workspace_id = document_schema.workspace_id
+        self.space_id = document_schema.space_id
+        self.advance = advance
+        self.cleanup = cleanup  # Delete the source once its files are stored, for uploaded archives
+
+        self.files_total = 0
+        self.files_ingested = 0
+        self.files_deduplicated = 0
+        self.files_failed = 0
+        self.failed_files = []
+        self.documents_created = 0
+        self.document_ids = []  # Created by the job, removed if it fails
+
+    @property
+    def files_per_second(self) -> float:
+        done = self.files_ingested + self.files_deduplicated
+        return done / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages_parsed / self.elapsed if self.elapsed else 0.0
+
+    def fail(self, file: StoredFile, error: Exception):
+        logger.error(f"Bulk ingestion job {self.id} could not ingest {file[0]}: {error}")
+        self.files_failed += 1
+        self.failed_files.append(file[0])
+
+    def create_documents(self, files: List[StoredFile]) -> List[int]:
+        """Creates the Document rows of the files and updates the space counter, in one transaction.
+        Returns:
+            list[int]: ids of the created documents.
+        """
+        schemas = [
+            DocumentRequest(title=title, owner_id=self.owner_id, workspace_id=self.workspace_id, space_id=self.space_id)
+            for title, _, _ in files
+        ]
+        document_service = DocumentsService()
+        document_ids = [
+            document.id for document in document_service.add_documents(schemas, [content_hash for _, _, content_hash in files])
+        ]
+        self.documents_created += len(document_ids)
+        self.document_ids.extend(document_ids)
+        return document_ids
+
+    def remove_documents(self, db, document_ids: List[int]):
+        """Deletes the vectors, chunk rows and Document rows of documents, so no later upload
+        is deduplicated against a partially ingested file."""
+        for document_id in document_ids:
+            try:
+                db.delete_document(self.space_id, document_id)
+            except Exception as e:
+                logger.error(f"Cleanup of document {document_id} failed: {e}")
+        DocumentsService().delete_documents(document_ids)
+        removed = set(document_ids)
+        self.document_ids = [document_id for document_id in self.document_ids if document_id not in removed]
+        self.documents_created -= len(removed)
+
+    def parse(self, files: List[StoredFile]) -> Iterator[tuple]:
+        """Parses the files in worker processes, yielding (file, pages, pairs) in order."""
+        workers = settings.BULK_PARSE_WORKERS
+        # spawn, the parent runs threads and must not be forked
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            in_flight = deque()
+            for file in files:
+                in_flight.append((file, executor.submit(parse_pdf, file[1])))
+                # Bounds the parsed files held in memory ahead of the embedding pipeline
+                if len(in_flight) >= 2 * workers:
+                    yield from self.collect(*in_flight.popleft())
+            while in_flight:
+                yield from self.collect(*in_flight.popleft())
+
+    def collect(self, file: StoredFile, future) -> Iterator[tuple]:
+        try:
+            pages, pairs = future.result()
+        except Exception as e:
+            self.fail(file, e)
+            return
+        self.progress("pages_parsed", pages)
+        yield file, pages, pairs
+
+    def chunks(self, db, files: List[StoredFile], documents: dict, registry: list):
+        """Yields the (window, chunk) pairs of all files, creating their Document rows in batches."""
+        for parsed in batched(self.parse(files), settings.BULK_DB_BATCH_SIZE):
+            created = self.create_documents([file for file, _, _ in parsed])
+            for (file, _, pairs), document_id in zip(parsed, created):
+                documents[file[2]] = (document_id, self.space_id)
+                records = []
+                yield from db.assign_ids(pairs, self.space_id, document_id, {}, records)
+                registry.extend((document_id, chunk_id, content_hash) for chunk_id, content_hash in records)
+                self.files_ingested += 1
+
+    def copy_duplicates(self, db, files: List[StoredFile], sources: dict):
+        """Creates the documents of already uploaded files from the vectors of their first upload."""
+        chunk_service = DocumentChunksService()
+        for batch in batched(files, settings.BULK_DB_BATCH_SIZE):
+            registry = []
+            for file, document_id in zip(batch, self.create_documents(batch)):
+                try:
+                    source_id, source_space_id = sources[file[2]]
+                    records = db.copy_document(
+                        source_id, self.space_id, document_id,
+                        progress=self.progress, source_space_id=source_space_id
+                    )
+                    if not records:
+                        # The first upload has no vectors, e.g. its ingestion failed
+                        records = db.embed_docs(file[1], self.space_id, document_id, progress=self.progress)
+                except Exception as e:
+                    self.remove_documents(db, [document_id])
+                    self.fail(file, e)
+                    continue
+                registry.extend((document_id, chunk_id, content_hash) for chunk_id, content_hash in records)
+                self.files_deduplicated += 1
+            chunk_service.add_chunks(registry)
+
+    def run(self, queue=None):
+        db = context_vectordb if self.advance else vectordb
+        try:
+            files = collect_files(self.source)
+        finally:
+            if self.cleanup:
+                os.remove(self.source)
+        self.files_total = len(files)
+
+        known = {
+            content_hash: (document.id, document.space_id)
+            for content_hash, document in DocumentsService().find_documents_by_hashes(
+                list({content_hash for _, _, content_hash in files})
+            ).items()
+        }
+        new_files, duplicates, seen = [], [], set()
+        for file in files:
+            content_hash = file[2]
+            if content_hash in known or content_hash in seen:
+                duplicates.append(file)
+            else:
+                seen.add(content_hash)
+                new_files.append(file)
+
+        try:
+            documents, registry = {}, []
+            db.write(self.chunks(db, new_files, documents, registry), self.progress)
+            chunk_service = DocumentChunksService()
+            for records in batched(registry, settings.CHROMA_BATCH_SIZE):
+                chunk_service.add_chunks(records)
+
+            sources = {**documents, **known}
+            for file in duplicates:
+                if file[2] not in sources:
+                    self.fail(file, ValueError("same file as one that failed to parse"))
+            self.copy_duplicates(db, [file for file in duplicates if file[2] in sources], sources)
+        except Exception:
+            # Vectors of the failed batch may be partially written, drop every document of the job
+            self.remove_documents(db, list(self.document_ids))
+            raise
+        logger.info(f"Bulk ingestion job {self.id} finished: {json.dumps(self.report())}")
+
+    def report(self) -> dict:
+        return {
+            "files_total": self.files_total,
+            "files_ingested": self.files_ingested,
+            "files_deduplicated": self.files_deduplicated,
+            "files_failed": self.files_failed,
+            "documents_created": self.documents_created,
+            "pages_parsed": self.pages_parsed,
+            "vectors_written": self.vectors_written,
+            "tokens_embedded": self.tokens_embedded,
+            "elapsed": round(self.elapsed, 2),
+            "files_per_second": round(self.files_per_second, 2),
+            "pages_per_second": round(self.pages_per_second, 2),
+            "chunks_per_second": round(self.chunks_per_second, 2),
+            "tokens_per_second": round(self.tokens_per_second, 2),
+        }
+
@@ -0,0 +1,37 @@
+"""Command line entry point of the bulk ingestion, kept apart from the job module.
+
+Parse workers are spawned processes: multiprocessing imports the main module of the parent
+in every worker unless it is a package __main__, so this module must stay light. The job
+module opens Chroma and starts the ingestion threads on import.
+"""
+import argparse
+import json
+
+from app.bulk_ingest import BulkIngestionJob
+from app.ingestion import ingestion_queue
+# Tables referenced by the foreign keys of documents, which the API maps on startup
+from app.models import user, workspace  # noqa: F401
+from app.schemas.document_request import DocumentRequest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest every PDF of a directory or zip archive into a space.")
+    parser.add_argument("source", help="directory or zip archive of PDFs")
+    parser.add_argument("--owner-id", type=int, required=True)
+    parser.add_argument("--workspace-id", type=int, required=True)
+    parser.add_argument("--space-id", type=int, required=True)
+    parser.add_argument("--no-advance", action="store_true", help="skip chunk contextualization")
+    args = parser.parse_args()
+
+    job = BulkIngestionJob(
+        args.source,
+        DocumentRequest(owner_id=args.owner_id, workspace_id=args.workspace_id, space_id=args.space_id),
+        advance=not args.no_advance,
+    )
+    ingestion_queue.run(job)
+    print(json.dumps({"status": job.status, "error": job.error, **job.report(), "failed_files": job.failed_files},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
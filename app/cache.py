@@ -0,0 +1,98 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List
+
+from app.core.config import settings
+
+SQLITE_MAX_VARIABLES = 500
+
+
+def cache_key(*parts) -> str:
+    """Content address of the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class SQLiteCache:
+    """Disk-backed key/value cache with least-recently-used eviction and hit/miss counters.
+
+    Values are stored as blobs; entries are content addressed, so a key never changes value.
+    """
+
+    def __init__(self, name: str, max_entries: int):
+        self.path = os.path.join(settings.CACHE_DIR, f"{name}.sqlite3")
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self.conn.commit()
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @staticmethod
+    def chunked(keys: List[str]) -> Iterable[List[str]]:
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            yield keys[i:i + SQLITE_MAX_VARIABLES]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """Returns the cached values of the keys that are present."""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for chunk in self.chunked(keys):
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: Dict[str, bytes]):
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO cache (key, value, accessed_at) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()]
+            )
+            self.entries += cursor.rowcount
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        excess = self.entries - self.max_entries
+        if excess <= 0:
+            return
+        cursor = self.conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (excess,)
+        )
+        self.entries -= cursor.rowcount
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,249 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import Checkpoint, CheckpointMetadata, CheckpointTuple, ChannelVersions, copy_checkpoint
+from langgraph.checkpoint.sqlite import SqliteSaver
+from loguru import logger
+
+from app.core.config import settings
+
+# Seconds between two expiries of idle threads, run by the next put
+EXPIRE_INTERVAL = 60
+
+
+class BoundedCheckpointer(SqliteSaver):
+    """Conversation checkpoints in SQLite, with the latest checkpoint of the active threads kept in memory.
+
+    Every checkpoint is written through to SQLite, so history survives restarts and is shared by
+    the workers using the same file. The latest checkpoint of at most `max_threads` threads is
+    cached, least recently used first out, and threads idle for `ttl` seconds leave the cache.
+    A cached checkpoint is only served while it is still the latest one in SQLite, which one
+    indexed lookup checks, so another worker's turn is never missed. Only the last `keep`
+    checkpoints of a thread and their writes are kept, and threads without a new checkpoint
+    for `expire_ttl` seconds are deleted from SQLite (never with 0).
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_threads: int, ttl: float, keep: int, expire_ttl: float = 0):
+        super().__init__(conn)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.keep = max(1, keep)
+        self.expire_ttl = expire_ttl
+        self.next_expiry = time.monotonic()
+        self.hot = OrderedDict()  # (thread_id, checkpoint_ns) -> (CheckpointTuple, last use)
+        self.hot_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        # Time of the last checkpoint of every thread, for the expiry of idle threads
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', updated_at REAL NOT NULL, "
+            "PRIMARY KEY (thread_id, checkpoint_ns))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS thread_activity_updated_at ON thread_activity (updated_at)")
+        # Threads written before activity was recorded start being idle now
+        self.conn.execute(
+            "INSERT OR IGNORE INTO thread_activity (thread_id, checkpoint_ns, updated_at) "
+            "SELECT DISTINCT thread_id, checkpoint_ns, ? FROM checkpoints",
+            (time.time(),),
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def key(config: RunnableConfig) -> tuple:
+        return str(config["configurable"]["thread_id"]), config["configurable"].get("checkpoint_ns", "")
+
+    def evict(self, now: float):
+        """Drops the threads idle for longer than ttl, then the least recently used ones above max_threads."""
+        while self.hot and (len(self.hot) > self.max_threads or next(iter(self.hot.values()))[1] < now - self.ttl):
+            self.hot.popitem(last=False)
+
+    def cache(self, key: tuple, checkpoint_tuple: Optional[CheckpointTuple]):
+        now = time.monotonic()
+        with self.hot_lock:
+            if checkpoint_tuple is None:
+                self.hot.pop(key, None)
+            else:
+                self.hot[key] = (checkpoint_tuple, now)
+                self.hot.move_to_end(key)
+            self.evict(now)
+
+    def latest_id(self, key: tuple) -> Optional[str]:
+        with self.cursor(transaction=False) as cur:
+            row = cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                key,
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        key = self.key(config)
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+        with self.hot_lock:
+            entry = self.hot.get(key)
+        if entry is not None:
+            cached = entry[0]
+            cached_id = cached.config["configurable"]["checkpoint_id"]
+            if (checkpoint_id or self.latest_id(key)) == cached_id:
+                self.cache(key, cached)
+                self.hits += 1
+                # The graph gets its own copy of the channel values, like after a read from SQLite
+                return cached._replace(checkpoint=copy_checkpoint(cached.checkpoint))
+        self.misses += 1
+        checkpoint_tuple = super().get_tuple(config)
+        if checkpoint_tuple is not None and not checkpoint_id:
+            self.cache(key, checkpoint_tuple)
+        return checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        key = self.key(saved)
+        self.compact_thread(key)
+        if self.expire_ttl and time.monotonic() >= self.next_expiry:
+            self.next_expiry = time.monotonic() + min(EXPIRE_INTERVAL, self.expire_ttl)
+            self.expire()
+        parent_id = config["configurable"].get("checkpoint_id")
+        self.cache(key, CheckpointTuple(
+            config=saved,
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=metadata,
+            parent_config={"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": parent_id}}
+            if parent_id else None,
+            pending_writes=[],
+        ))
+        return saved
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        # Pending writes are read back with their checkpoint from SQLite
+        self.cache(self.key(config), None)
+
+    def compact_thread(self, key: tuple):
+        """Records the activity of a thread and deletes its checkpoints older than the last `keep` ones, with their writes."""
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, checkpoint_ns, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (thread_id, checkpoint_ns) DO UPDATE SET updated_at = excluded.updated_at",
+                (*key, time.time()),
+            )
+            oldest_kept = cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                (*key, self.keep - 1),
+            ).fetchone()
+            if oldest_kept is None:
+                return
+            for table in ("checkpoints", "writes"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    (*key, oldest_kept[0]),
+                )
+
+    def expire(self) -> int:
+        """Deletes the checkpoints and writes of the threads idle for longer than expire_ttl.
+        Returns:
+            int: number of deleted threads.
+        """
+        if not self.expire_ttl:
+            return 0
+        cutoff = time.time() - self.expire_ttl
+        idle = "SELECT thread_id, checkpoint_ns FROM thread_activity WHERE updated_at < ?"
+        # One transaction, a thread written by another worker meanwhile is kept
+        with self.cursor() as cur:
+            for table in ("checkpoints", "writes"):
+                cur.execute(f"DELETE FROM {table} WHERE (thread_id, checkpoint_ns) IN ({idle})", (cutoff,))
+            expired = cur.execute("DELETE FROM thread_activity WHERE updated_at < ?", (cutoff,)).rowcount
+        if expired:
+            self.expired += expired
+            logger.info(f"Deleted {expired} conversations idle for more than {self.expire_ttl:g} s")
+        return expired
+
+    def compact(self) -> int:
+        """Compacts every thread, for checkpoints written before compaction or with a larger keep.
+        Returns:
+            int: number of deleted checkpoints.
+        """
+        with self.cursor() as cur:
+            deleted = cur.execute(
+                "DELETE FROM checkpoints WHERE rowid IN (SELECT rowid FROM ("
+                "SELECT rowid, ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS n "
+                "FROM checkpoints) WHERE n > ?)",
+                (self.keep,),
+            ).rowcount
+            cur.execute(
+                "DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints WHERE "
+                "checkpoints.thread_id = writes.thread_id AND checkpoints.checkpoint_ns = writes.checkpoint_ns "
+                "AND checkpoints.checkpoint_id = writes.checkpoint_id)"
+            )
+        return deleted
+
+    def stats(self) -> dict:
+        with self.hot_lock:
+            self.evict(time.monotonic())
+            hot = len(self.hot)
+        with self.cursor(transaction=False) as cur:
+            threads, checkpoints = cur.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+        return {
+            "hot_threads": hot,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "threads": threads,
+            "checkpoints": checkpoints,
+        }
+
+
+def create_checkpointer(path: str = settings.CHECKPOINT_DB) -> BoundedCheckpointer:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return BoundedCheckpointer(
+        conn, settings.CHECKPOINT_CACHE_THREADS, settings.CHECKPOINT_CACHE_TTL, settings.CHECKPOINT_KEEP,
+        settings.CHECKPOINT_TTL,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the conversation checkpoints.")
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="delete the threads idle for CHECKPOINT_TTL and keep the last CHECKPOINT_KEEP checkpoints of the others"
+    )
+    args = parser.parse_args()
+
+    checkpointer = create_checkpointer()
+    if args.compact:
+        expired = checkpointer.expire()
+        deleted = checkpointer.compact()
+        with checkpointer.cursor() as cur:
+            cur.execute("VACUUM")
+        logger.info(f"Deleted {expired} idle threads and {deleted} old checkpoints")
+    stats = checkpointer.stats()
+    print(
+        f"{stats['threads']} threads, {stats['checkpoints']} checkpoints in {settings.CHECKPOINT_DB} "
+        f"({os.path.getsize(settings.CHECKPOINT_DB) / 1e6:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from app.core.config import settings
+
+SQLITE_MAX_VARIABLES = 500
+# Metadata kept in Chroma, the fields searches filter on
+FILTER_FIELDS = ("space_id", "document_id")
+CHROMA_SEGMENT = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def filter_metadata(metadata: dict) -> dict:
+    """The part of a chunk's metadata stored with its vector."""
+    return {key: metadata[key] for key in FILTER_FIELDS if metadata.get(key) is not None}
+
+
+def chroma_size(path: str) -> int:
+    """Bytes of the Chroma files of a persist directory: its SQLite database and the HNSW segments."""
+    size = 0
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if name.startswith("chroma.sqlite3"):
+            size += os.path.getsize(full)
+        elif CHROMA_SEGMENT.match(name) and os.path.isdir(full):
+            size += sum(entry.stat().st_size for entry in os.scandir(full) if entry.is_file())
+    return size
+
+
+class ChunkStore:
+    """Text and metadata of the chunks, stored once per chunk in SQLite and keyed by chunk id.
+
+    Chroma only holds the vectors and the FILTER_FIELDS, searches return ids and the text is read
+    here for the chunks that are actually used. A contextualized chunk is stored as its original
+    text and its context, its embedded text and origin_content/contextualized_content metadata
+    are rebuilt from both. Texts are zlib-compressed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, text BLOB NOT NULL, context BLOB, metadata TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def chunked(values: list) -> Iterable[list]:
+        for i in range(0, len(values), SQLITE_MAX_VARIABLES):
+            yield values[i:i + SQLITE_MAX_VARIABLES]
+
+    @staticmethod
+    def encode(doc: Document) -> Tuple[bytes, Optional[bytes], str]:
+        metadata = dict(doc.metadata)
+        text, context = doc.page_content, None
+        origin = metadata.get("origin_content")
+        contextualized = metadata.get("contextualized_content")
+        if origin is not None and contextualized is not None and doc.page_content == f"{origin}\n\n{contextualized}":
+            text, context = metadata.pop("origin_content"), metadata.pop("contextualized_content")
+        return (
+            zlib.compress(text.encode("utf-8")),
+            zlib.compress(context.encode("utf-8")) if context is not None else None,
+            json.dumps(metadata),
+        )
+
+    @staticmethod
+    def decode(text: bytes, context: Optional[bytes], metadata: str) -> Tuple[str, dict]:
+        text = zlib.decompress(text).decode("utf-8")
+        metadata = json.loads(metadata)
+        if context is None:
+            return text, metadata
+        context = zlib.decompress(context).decode("utf-8")
+        metadata["origin_content"] = text
+        metadata["contextualized_content"] = context
+        return f"{text}\n\n{context}", metadata
+
+    def add(self, docs: List[Document]):
+        """Stores the text and metadata of Documents carrying their chunk id, replacing stored chunks."""
+        if not docs:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, text, context, metadata) VALUES (?, ?, ?, ?)",
+                [(doc.id, *self.encode(doc)) for doc in docs]
+            )
+            self.conn.commit()
+
+    def get(self, chunk_ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        """(text, metadata) of the stored chunks among chunk_ids."""
+        rows = []
+        with self.lock:
+            for chunk in self.chunked(list(dict.fromkeys(chunk_ids))):
+                rows.extend(self.conn.execute(
+                    f"SELECT chunk_id, text, context, metadata FROM chunks WHERE chunk_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        return {chunk_id: self.decode(*row) for chunk_id, *row in rows}
+
+    def delete(self, chunk_ids: List[str]):
+        if not chunk_ids:
+            return
+        with self.lock:
+            for chunk in self.chunked(list(chunk_ids)):
+                self.conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(chunk))})", chunk)
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def migrate(self, collection) -> int:
+        """Moves the text and metadata of the chunks a collection stored before the chunk store existed.
+
+        The chunks are written to the store first, then upserted with their vector and no document.
+        Chroma merges the metadata of an upsert into the stored one and can't remove keys, so the
+        keys other than the filter fields are blanked. Every step is idempotent: an interrupted
+        migration is resumed by running it again.
+        Returns:
+            int: number of moved chunks.
+        """
+        moved = 0
+        offset = 0
+        while True:
+            results = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=settings.CHROMA_BATCH_SIZE, offset=offset
+            )
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+            rows = [
+                row for row in zip(results["ids"], results["embeddings"], results["documents"], results["metadatas"])
+                if row[2] is not None or any(value != "" for key, value in (row[3] or {}).items() if key not in FILTER_FIELDS)
+            ]
+            if not rows:
+                continue
+            ids, vectors, texts, metadatas = (list(column) for column in zip(*rows))
+            stored = self.get(ids)
+            self.add([
+                Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)
+                if chunk_id not in stored and text is not None
+            ])
+            collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                documents=[None] * len(ids),
+                metadatas=[
+                    {**{key: "" for key in metadata or {}}, **filter_metadata(metadata or {})} for metadata in metadatas
+                ],
+            )
+            moved += len(ids)
+            logger.info(f"Moved {moved} chunks of {collection.name}")
+        return moved
+
+chunk_store = ChunkStore(os.path.join(settings.VECTORDB_PERSIST_DIR, "chunks.sqlite3"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the text store of the chunks.")
+    parser.add_argument("--migrate", action="store_true", help="move the texts and metadata stored in Chroma")
+    args = parser.parse_args()
+
+    if args.migrate:
+        from app.partitions import partitions
+
+        before = chroma_size(settings.VECTORDB_PERSIST_DIR)
+        moved = sum(chunk_store.migrate(collection) for collection in partitions.all())
+        after = chroma_size(settings.VECTORDB_PERSIST_DIR)
+        print(f"Moved {moved} chunks, Chroma files {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+        print(f"Run `chroma utils vacuum --path {settings.VECTORDB_PERSIST_DIR}` with the API stopped to return the freed pages")
+    print(f"{chunk_store.count()} chunks stored in {chunk_store.path} ({os.path.getsize(chunk_store.path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
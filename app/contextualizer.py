@@ -0,0 +1,150 @@
+import asyncio
+import random
+import threading
+import time
+from typing import List, Tuple
+
+import openai
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+from loguru import logger
+
+from app.cache import SQLiteCache, cache_key
+from app.core.config import settings
+
+DOCUMENT_CONTEXT_PROMPT = """
+<document>
+{doc_content}
+</document>
+"""
+
+CHUNK_CONTEXT_PROMPT = """
+Here is the chunk we want to situate within the whole document
+<chunk>
+{chunk_content}
+</chunk>
+
+Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
+Answer only with the succinct context and nothing else.
+Answer directly with the content of the chunk without prefacing it with phrases like 'The chunk provides...' or 'This chunk is part of...'. Focus solely on delivering the relevant information.
+"""
+
+MODEL = "gpt-4o-mini"
+MAX_TOKENS = 1024
+# Bump whenever the prompts above change so cached contexts are not reused
+PROMPT_VERSION = 1
+# Rate limits, timeouts, connection errors and 5xx responses are retried with backoff
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    """Paces requests so the estimated token usage stays under a tokens-per-minute budget."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+
+    async def acquire(self, tokens: int):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Take the tokens right away and wait until the debt is paid back
+        self.tokens -= tokens
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Contextualizer:
+    """Generates the situating context of chunks with concurrent, rate-limited `ainvoke` calls.
+
+    All requests run on one event loop owned by a background thread, so the concurrency
+    limit and the token budget are shared by every ingestion job of the process.
+    """
+
+    def __init__(self):
+        # Retries are handled here so that 429s and transient errors go through the backoff below
+        self.llm = ChatOpenAI(
+            model=MODEL,
+            temperature=0.0,
+            max_tokens=MAX_TOKENS,
+            max_retries=0,
+        )
+        self.semaphore = asyncio.Semaphore(settings.CONTEXTUALIZE_CONCURRENCY)
+        self.bucket = TokenBucket(settings.CONTEXTUALIZE_TOKENS_PER_MINUTE)
+        self.cache = SQLiteCache("contextualization", settings.CONTEXT_CACHE_MAX_ENTRIES)
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="contextualizer", daemon=True).start()
+
+    @staticmethod
+    def estimate_tokens(messages: List[HumanMessage]) -> int:
+        # OpenAI counts max_tokens against the rate limit, roughly 4 characters per prompt token
+        return sum(len(m.content) for m in messages) // 4 + MAX_TOKENS
+
+    @staticmethod
+    def backoff(attempt: int, error: openai.OpenAIError) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return min(60, 2 ** attempt) + random.uniform(0, 1)
+
+    async def asituate(self, window: str, chunk: str, progress=None) -> str:
+        mess = [
+            HumanMessage(content=DOCUMENT_CONTEXT_PROMPT.format(doc_content=window)),
+            HumanMessage(content=CHUNK_CONTEXT_PROMPT.format(chunk_content=chunk)),
+        ]
+        tokens = self.estimate_tokens(mess)
+        async with self.semaphore:
+            for attempt in range(settings.CONTEXTUALIZE_MAX_RETRIES + 1):
+                await self.bucket.acquire(tokens)
+                try:
+                    response = await self.llm.ainvoke(mess)
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt == settings.CONTEXTUALIZE_MAX_RETRIES:
+                        raise
+                    delay = self.backoff(attempt, e)
+                    logger.warning(f"{type(e).__name__} while contextualizing, retrying in {delay:.1f} s")
+                    await asyncio.sleep(delay)
+        if progress:
+            progress("chunks_contextualized")
+        return response.content
+
+    async def acontextualize(self, pairs: List[Tuple[str, str]], progress=None) -> List[str]:
+        tasks = [asyncio.ensure_future(self.asituate(window, chunk, progress)) for window, chunk in pairs]
+        try:
+            # gather keeps the results in the order of the chunks
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # The job fails with the first error, its other requests would only spend the budget
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def contextualize(self, pairs: List[Tuple[str, str]], progress=None) -> List[str]:
+        """Returns the context of every (window, chunk) pair, in order.
+
+        Contexts are cached by (model, prompt version, window, chunk), only the misses call the LLM.
+        """
+        keys = [cache_key(MODEL, PROMPT_VERSION, window, chunk) for window, chunk in pairs]
+        cached = self.cache.get_many(keys)
+        if cached and progress:
+            progress("chunks_contextualized", sum(key in cached for key in keys))
+
+        misses = list({key: pair for key, pair in zip(keys, pairs) if key not in cached}.items())
+        if misses:
+            future = asyncio.run_coroutine_threadsafe(
+                self.acontextualize([pair for _, pair in misses], progress), self.loop
+            )
+            contexts = future.result()
+            self.cache.set_many({key: context.encode("utf-8") for (key, _), context in zip(misses, contexts)})
+            cached.update((key, context.encode("utf-8")) for (key, _), context in zip(misses, contexts))
+
+        return [cached[key].decode("utf-8") for key in keys]
+
+
+contextualizer = Contextualizer()
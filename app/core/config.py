@@ -28,6 +28,8 @@ class Settings(BaseSettings):
     # DIR
     PDF_DIR = os.getenv("PDF_DIR", "/mnt/data/pdf")
     os.makedirs(PDF_DIR, exist_ok=True)
+    CACHE_DIR = os.getenv("CACHE_DIR", "/mnt/data/cache")
+    os.makedirs(CACHE_DIR, exist_ok=True)
 
     # VECTORDB
     VECTORDB_PERSIST_DIR=os.getenv("VECTORDB_PERSIST_DIR", "")
@@ -40,6 +42,68 @@ class Settings(BaseSettings):
         "hnsw:M": 16,  # Maximum number of connections per vector
         "hnsw:search_ef": 10,  # Number of neighbors explored during search
     }
+    VECTORDB_PARTITION = os.getenv("VECTORDB_PARTITION", "none")  # none, space or workspace collections
+    VECTORDB_OPEN_PARTITIONS = int(os.getenv("VECTORDB_OPEN_PARTITIONS", 256))  # Collection handles kept open
+    VECTORDB_MEMORY_LIMIT = int(os.getenv("VECTORDB_MEMORY_LIMIT", 0))  # Bytes of HNSW indexes kept loaded, 0 for no limit
+    EXACT_SEARCH_MAX_VECTORS = int(os.getenv("EXACT_SEARCH_MAX_VECTORS", 20000))  # Larger spaces use HNSW, 0 disables exact search
+    EXACT_SEARCH_RECALL_SAMPLE = float(os.getenv("EXACT_SEARCH_RECALL_SAMPLE", 0.01))  # Share of exact searches repeated with HNSW to measure its recall
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # none, int8 or binary codes of the exact-search spaces, HNSW indexes stay float32
+    QUANTIZATION_RESCORE = int(os.getenv("QUANTIZATION_RESCORE", 10))  # Candidates rescored in full precision, times k
+    ANN_DIMENSIONS = int(os.getenv("ANN_DIMENSIONS", 0))  # Leading vector dimensions kept in Chroma, 0 keeps all
+    ANN_RESCORE = int(os.getenv("ANN_RESCORE", 4))  # Candidates rescored with the full vectors, times k
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"  # Fuse BM25 results with the vector search
+    RRF_K = int(os.getenv("RRF_K", 60))  # Rank offset of reciprocal rank fusion
+
+    # INGESTION
+    INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))
+    INGESTION_MAX_JOBS = int(os.getenv("INGESTION_MAX_JOBS", 1000))  # Finished jobs kept for status queries
+    INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", 64))  # Chunks contextualized and written per batch
+    INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 256))  # Parsed chunks buffered ahead of the batches
+    PDF_BACKEND = os.getenv("PDF_BACKEND", "pypdf")  # pypdf, or pymupdf when installed
+    PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", min(4, os.cpu_count())))  # Processes extracting pages
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))  # Pages extracted per worker task
+    BULK_IMPORT_DIR = os.getenv("BULK_IMPORT_DIR", "/mnt/data/import")  # Server-side directories must live here
+    BULK_PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", max(1, os.cpu_count() - 3)))
+    BULK_DB_BATCH_SIZE = int(os.getenv("BULK_DB_BATCH_SIZE", 50))  # Documents created per transaction
+
+    # CONTEXTUALIZATION
+    CONTEXTUALIZE_CONCURRENCY = int(os.getenv("CONTEXTUALIZE_CONCURRENCY", 16))  # LLM calls in flight per process
+    CONTEXTUALIZE_TOKENS_PER_MINUTE = int(os.getenv("CONTEXTUALIZE_TOKENS_PER_MINUTE", 200000))
+    CONTEXTUALIZE_MAX_RETRIES = int(os.getenv("CONTEXTUALIZE_MAX_RETRIES", 6))  # Retries on 429, 5xx, timeout and connection errors
+    CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", 1000000))
+
+    # EMBEDDINGS
+    EMBEDDING_LRU_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", 4096))  # Vectors kept in process memory
+    QUERY_EMBEDDING_LRU_SIZE = int(os.getenv("QUERY_EMBEDDING_LRU_SIZE", 4096))  # Question vectors kept in memory
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1000000))  # Vectors kept on disk
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))  # Texts per embedding request
+    EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))  # Embedding requests in flight
+    CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 512))  # Vectors per Chroma upsert
+
+    # RERANKING
+    RERANKER = os.getenv("RERANKER", "llm")  # llm, cross-encoder or mmr, opt in once python -m benchmarks.rerank holds up on your questions
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_RUNTIME = os.getenv("RERANK_RUNTIME", "onnx")  # onnx, torch or torch-int8
+    RERANK_ONNX_FILE = os.getenv("RERANK_ONNX_FILE", "onnx/model.onnx")  # e.g. onnx/model_qint8_avx512.onnx
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))  # Pairs scored per forward pass
+    RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 512))  # Tokens per (query, document) pair
+    RERANK_THREADS = int(os.getenv("RERANK_THREADS", max(1, os.cpu_count() // 2)))
+    RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", 0.7))  # 1 ranks by relevance only, 0 by diversity only
+
+    # ANSWER CACHE
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))  # Cosine similarity of a hit
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))  # Seconds an answer is served
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10000))
+
+    # AGENT
+    TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", 8))  # Tool calls run concurrently per process
+    TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", 60))  # Seconds a tool call may run before the model is told it timed out
+    CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(CACHE_DIR, "checkpoints.sqlite3"))  # Conversation history, shared by the workers of a host
+    CHECKPOINT_CACHE_THREADS = int(os.getenv("CHECKPOINT_CACHE_THREADS", 1000))  # Active conversations kept in memory
+    CHECKPOINT_CACHE_TTL = int(os.getenv("CHECKPOINT_CACHE_TTL", 900))  # Seconds an idle conversation stays in memory
+    CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP", 2))  # Checkpoints kept per conversation, older ones are deleted
+    CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", 7 * 24 * 3600))  # Seconds without a turn before a conversation is deleted, 0 keeps them
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", 8000))  # Prompt tokens of the conversation sent to the model, system prompt included
 
 
     @staticmethod
@@ -0,0 +1,31 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyStats:
+    """Latencies of the last `size` calls of an operation, reported as percentiles."""
+
+    def __init__(self, size: int = 1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            samples = np.array(self.samples) * 1000
+            count = self.count
+        if not len(samples):
+            return {"count": count}
+        return {
+            "count": count,
+            "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)),
+            "p99_ms": float(np.percentile(samples, 99)),
+        }
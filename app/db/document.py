@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
+from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 
 from app.db.base import get_session
 from app.models.document import Document
+from app.models.document_chunk import DocumentChunk
+from app.models.space import Space
 from app.schemas.document_request import DocumentRequest, DocumentUpdateRequest
 
 
@@ -70,10 +73,92 @@ class DocumentsService:
             )
         return document
 
-    def add_document(self, document_schema: DocumentRequest) -> Document:
+    def find_document_by_hash(self, content_hash: str) -> Optional[Document]:
+        """Finds the first document uploaded with the given file content hash.
+        Args:
+            content_hash: SHA-256 of the file.
+        Returns:
+            document: found document, None if the file was never uploaded.
+        """
+        document = (
+            self.session
+            .query(Document)
+            .filter(Document.content_hash == content_hash)
+            .order_by(Document.id)
+            .first()
+        )
+        return document
+
+    def find_documents_by_hashes(self, content_hashes: list[str]) -> dict[str, Document]:
+        """Finds the first document uploaded with each of the given file content hashes.
+        Args:
+            content_hashes: SHA-256 of the files.
+        Returns:
+            dict: content hash -> found document, hashes never uploaded are missing.
+        """
+        documents = (
+            self.session
+            .query(Document)
+            .filter(Document.content_hash.in_(content_hashes))
+            .order_by(Document.id.desc())
+            .all()
+        )
+        return {document.content_hash: document for document in documents}
+
+    def add_documents(self, document_schemas: list[DocumentRequest], content_hashes: list[str]) -> list[Document]:
+        """Creates documents by given document schemas and increases the document count of their
+        spaces, in one transaction.
+        Args:
+            document_schemas: document request schemas.
+            content_hashes: SHA-256 of the uploaded files.
+        Returns:
+            list[Document]: created documents.
+        """
+        documents = [
+            Document(
+                title=document_schema.title,
+                owner_id=document_schema.owner_id,
+                workspace_id=document_schema.workspace_id,
+                space_id=document_schema.space_id,
+                content_hash=content_hash,
+            )
+            for document_schema, content_hash in zip(document_schemas, content_hashes)
+        ]
+        self.session.add_all(documents)
+        for space_id in {document.space_id for document in documents}:
+            space = self.session.get(Space, space_id)
+            if space:
+                space.num_documents += sum(document.space_id == space_id for document in documents)
+        self.session.commit()
+        return documents
+
+    def delete_documents(self, document_ids: list[int]) -> None:
+        """Deletes documents with their chunk rows and decreases the document count of their
+        spaces, in one transaction.
+        Args:
+            document_ids: ids of the documents.
+        """
+        if not document_ids:
+            return
+        documents = self.session.query(Document).filter(Document.id.in_(document_ids)).all()
+        (
+            self.session
+            .query(DocumentChunk)
+            .filter(DocumentChunk.document_id.in_(document_ids))
+            .delete(synchronize_session=False)
+        )
+        for document in documents:
+            space = self.session.get(Space, document.space_id)
+            if space:
+                space.num_documents = max(0, space.num_documents - 1)
+            self.session.delete(document)
+        self.session.commit()
+
+    def add_document(self, document_schema: DocumentRequest, content_hash: Optional[str] = None) -> Document:
         """Creates document by given document schema and saves it in database.
         Args:
             document_schema: document request schema.
+            content_hash: SHA-256 of the uploaded file.
         Returns:
             document: found document.
         """
@@ -82,6 +167,7 @@ class DocumentsService:
             owner_id=document_schema.owner_id,
             workspace_id=document_schema.workspace_id,
             space_id=document_schema.space_id,
+            content_hash=content_hash,
         )
         self.session.add(document)
         self.session.commit()
@@ -104,6 +190,21 @@ class DocumentsService:
         self.session.commit()
         return document
 
+    def update_document_file(self, document_id: int, title: str, content_hash: str) -> Document:
+        """Points document to a new revision of its file.
+        Args:
+            document_id: changeable document id.
+            title: file name of the new revision.
+            content_hash: SHA-256 of the new revision.
+        Returns:
+            document: updated document.
+        """
+        document = self.get_document_by_id(document_id)
+        document.title = title
+        document.content_hash = content_hash
+        self.session.commit()
+        return document
+
     def delete_document(self, document_id: int) -> None:
         """Deletes document by given id.
         Args:
@@ -0,0 +1,87 @@
+from typing import Dict, List, Tuple
+
+from app.db.base import get_session
+from app.models.document_chunk import DocumentChunk
+
+
+
+class DocumentChunksService:
+    """Document chunks service for interacting with the database."""
+
+    def __init__(self) -> None:
+        self.session = next(get_session())
+
+    def __del__(self):
+        self.session.close()  # Ensure the session is closed when the object is destroyed
+
+    def get_chunks(self, document_id: int) -> list[DocumentChunk]:
+        """Returns the chunks of a document.
+        Args:
+            document_id: document id.
+        Returns:
+            list[DocumentChunk]: list of chunks.
+        """
+        chunks = (
+            self.session
+            .query(DocumentChunk)
+            .filter(DocumentChunk.document_id == document_id)
+            .order_by(DocumentChunk.id)
+            .all()
+        )
+        return chunks
+
+    def get_chunk_ids_by_hash(self, document_id: int) -> Dict[str, List[str]]:
+        """Groups the chunk ids of a document by content hash.
+        Args:
+            document_id: document id.
+        Returns:
+            dict: content hash -> chunk ids.
+        """
+        chunk_ids = {}
+        for chunk in self.get_chunks(document_id):
+            chunk_ids.setdefault(chunk.content_hash, []).append(chunk.chunk_id)
+        return chunk_ids
+
+    def set_chunks(self, document_id: int, records: List[Tuple[str, str]]) -> None:
+        """Replaces the chunks of a document in one transaction.
+        Args:
+            document_id: document id.
+            records: (chunk_id, content_hash) of every chunk the document now has.
+        """
+        chunk_ids = {chunk_id for chunk_id, _ in records}
+        registered = set()
+        for chunk in self.get_chunks(document_id):
+            if chunk.chunk_id in chunk_ids:
+                registered.add(chunk.chunk_id)
+            else:
+                self.session.delete(chunk)
+        self.session.add_all([
+            DocumentChunk(document_id=document_id, chunk_id=chunk_id, content_hash=content_hash)
+            for chunk_id, content_hash in records
+            if chunk_id not in registered
+        ])
+        self.session.commit()
+
+    def add_chunks(self, records: List[Tuple[int, str, str]]) -> None:
+        """Registers chunks of any number of documents in one transaction.
+        Args:
+            records: (document_id, chunk_id, content_hash) of the new chunks.
+        """
+        self.session.add_all([
+            DocumentChunk(document_id=document_id, chunk_id=chunk_id, content_hash=content_hash)
+            for document_id, chunk_id, content_hash in records
+        ])
+        self.session.commit()
+
+    def delete_chunks(self, document_id: int) -> None:
+        """Deletes all chunks of a document.
+        Args:
+            document_id: document id.
+        """
+        (
+            self.session
+            .query(DocumentChunk)
+            .filter(DocumentChunk.document_id == document_id)
+            .delete(synchronize_session=False)
+        )
+        self.session.commit()
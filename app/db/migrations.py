@@ -0,0 +1,31 @@
+from sqlalchemy import Engine, inspect, text
+from loguru import logger
+
+from app.models.base import Base
+
+
+def add_missing_columns(engine: Engine):
+    """Adds the model columns missing from existing tables, with their indexes.
+
+    create_all only creates missing tables, so tables created by an older version need the
+    columns added since (e.g. documents.content_hash). New columns must be nullable.
+    Args:
+        engine: engine of the metadata database.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            added = set()
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.add(column.name)
+                logger.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                if added & {column.name for column in index.columns}:
+                    index.create(conn, checkfirst=True)
@@ -117,15 +117,28 @@ class SpacesService:
         self.session.commit()
         return space
 
-    def increase_num_documents(self, space_id: int) -> Space:
+    def increase_num_documents(self, space_id: int, count: int = 1) -> Space:
         """Updates space by given space schema.
         Args:
             space_id: changeable space id.
+            count: number of added documents.
         Returns:
             space: updated space.
         """
         space = self.get_space_by_id(space_id)
-        space.num_documents += 1
+        space.num_documents += count
+        self.session.commit()
+        return space
+
+    def decrease_num_documents(self, space_id: int) -> Space:
+        """Updates space by given space schema.
+        Args:
+            space_id: changeable space id.
+        Returns:
+            space: updated space.
+        """
+        space = self.get_space_by_id(space_id)
+        space.num_documents = max(0, space.num_documents - 1)
         self.session.commit()
         return space
 
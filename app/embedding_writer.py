@@ -0,0 +1,137 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import Iterable, List
+from uuid import uuid4
+
+import tiktoken
+from langchain_core.documents import Document
+from loguru import logger
+
+from app.chunk_store import chunk_store, filter_metadata
+from app.core.config import settings
+from app.embeddings import CachedEmbeddings
+from app.exact_search import exact_index
+from app.matryoshka import full_vectors, truncate
+from app.partitions import Partitions
+from app.pipeline import batched
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """Tokenizer of the text-embedding-3 models, None if it can't be loaded (tiktoken downloads it on first use)."""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Embedded tokens are estimated from the text length, the tokenizer failed to load: {e}")
+        return None
+
+
+def count_tokens(texts: List[str]) -> int:
+    """Tokens of the texts, for the throughput metrics only, so it never fails a write."""
+    encoding = get_encoding()
+    if encoding is None:
+        # About 4 characters per token for English text
+        return sum(len(text) for text in texts) // 4
+    return sum(len(tokens) for tokens in encoding.encode_ordinary_batch(texts))
+
+
+class EmbeddingWriter:
+    """Embeds documents in fixed-size batches with several requests in flight and writes them to Chroma.
+
+    Embedding batches run on a shared thread pool while the calling thread upserts the
+    finished ones, so network time and Chroma writes overlap. Every document goes to the
+    partition of its space_id metadata, with its filter fields only: the text and the rest of
+    the metadata go to the chunk store. With ANN_DIMENSIONS, Chroma gets the truncated vectors
+    and the full ones go to the full vector store and the exact index.
+    """
+
+    def __init__(self, embeddings: CachedEmbeddings, partitions: Partitions):
+        self.embeddings = embeddings
+        self.partitions = partitions
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.EMBEDDING_CONCURRENCY,
+            thread_name_prefix="embedding"
+        )
+
+    def embed(self, docs: List[Document]):
+        texts = [doc.page_content for doc in docs]
+        return self.embeddings.embed_vectors(texts), count_tokens(texts)
+
+    def upsert(self, pending: list) -> List[str]:
+        for doc, _ in pending:
+            doc.id = doc.id or str(uuid4())
+        ids = [doc.id for doc, _ in pending]
+        # Stored first, a chunk found by a search always has its text
+        chunk_store.add([doc for doc, _ in pending])
+        groups = {}
+        for chunk_id, (doc, vector) in zip(ids, pending):
+            groups.setdefault(doc.metadata.get("space_id"), []).append((chunk_id, doc, vector))
+        for space_id, rows in groups.items():
+            chunk_ids = [chunk_id for chunk_id, _, _ in rows]
+            vectors = [vector for _, _, vector in rows]
+            self.partitions.collection(space_id).upsert(
+                ids=chunk_ids,
+                embeddings=list(truncate(vectors, settings.ANN_DIMENSIONS)),
+                metadatas=[filter_metadata(doc.metadata) for _, doc, _ in rows],
+            )
+            if space_id is not None:
+                stored_count = lambda: self.partitions.count(space_id)
+                exact_index.add(space_id, chunk_ids, vectors, stored_count)
+                if full_vectors:
+                    full_vectors.add(space_id, chunk_ids, vectors, stored_count)
+        return ids
+
+    @settings.timeit
+    def write(self, batches: Iterable[List[Document]], progress=None) -> List[str]:
+        """Embeds and stores the documents, in order.
+        Args:
+            batches: document batches of any size, they are re-batched by EMBEDDING_BATCH_SIZE.
+        Returns:
+            list[str]: ids of the written documents.
+        """
+        start = time.perf_counter()
+        uuids = []
+        tokens = 0
+        in_flight = deque()
+        pending = []
+
+        def flush():
+            ids = self.upsert(pending)
+            uuids.extend(ids)
+            pending.clear()
+            if progress:
+                progress("vectors_written", len(ids))
+
+        def collect():
+            nonlocal tokens
+            docs, future = in_flight.popleft()
+            vectors, n_tokens = future.result()
+            tokens += n_tokens
+            if progress:
+                progress("tokens_embedded", n_tokens)
+            pending.extend(zip(docs, vectors))
+            if len(pending) >= settings.CHROMA_BATCH_SIZE:
+                flush()
+
+        try:
+            for docs in batched(chain.from_iterable(batches), settings.EMBEDDING_BATCH_SIZE):
+                in_flight.append((docs, self.executor.submit(self.embed, docs)))
+                if len(in_flight) >= settings.EMBEDDING_CONCURRENCY:
+                    collect()
+            while in_flight:
+                collect()
+            if pending:
+                flush()
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        logger.info(
+            f"Wrote {len(uuids)} chunks in {elapsed:.2f} s "
+            f"({len(uuids) / elapsed:.1f} chunks/s, {tokens / elapsed:.0f} tokens/s)"
+        )
+        return uuids
@@ -0,0 +1,137 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from app.cache import SQLiteCache, cache_key
+from app.core.config import settings
+
+
+class LRUCache:
+    """Thread-safe in-process mapping that forgets the least recently used entries."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CachedEmbeddings(Embeddings):
+    """OpenAI embeddings behind an in-process LRU tier and a SQLite tier of float32 vectors.
+
+    Vectors are keyed by (model, dimensions, text hash). Lookups go memory -> disk, and all
+    remaining misses of a call are embedded in one batched request. Questions have an LRU of
+    their own, so ingestion traffic does not evict them.
+    """
+
+    def __init__(self, model: str = "text-embedding-3-small", dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+        self.client = OpenAIEmbeddings(model=model, dimensions=dimensions)
+        self.memory = LRUCache(settings.EMBEDDING_LRU_SIZE)
+        self.queries = LRUCache(settings.QUERY_EMBEDDING_LRU_SIZE)
+        self.disk = SQLiteCache("embeddings", settings.EMBEDDING_CACHE_MAX_ENTRIES)
+        self.memory_hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def key(self, text: str) -> str:
+        return cache_key(self.model, self.dimensions or "", text)
+
+    def embed_vectors(self, texts: List[str]) -> List[np.ndarray]:
+        """Embeds the texts as float32 arrays, going to the API only for the cache misses."""
+        keys = [self.key(text) for text in texts]
+        vectors = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                vectors[key] = vector
+        self.memory_hits += len(vectors)
+
+        missing = [key for key in keys if key not in vectors]
+        for key, blob in self.disk.get_many(missing).items():
+            vectors[key] = np.frombuffer(blob, dtype=np.float32)
+            self.memory.put(key, vectors[key])
+
+        misses = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if misses:
+            self.misses += len(misses)
+            embedded = self.client.embed_documents(list(misses.values()))
+            fresh = {}
+            for key, embedding in zip(misses, embedded):
+                vectors[key] = np.asarray(embedding, dtype=np.float32)
+                fresh[key] = vectors[key].tobytes()
+                self.memory.put(key, vectors[key])
+            self.disk.set_many(fresh)
+
+        return [vectors[key] for key in keys]
+
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        # Questions differing only by spacing share one vector
+        return re.sub(r"\s+", " ", text).strip()
+
+    def embed_query_vectors(self, texts: List[str]) -> List[np.ndarray]:
+        """Embeds questions, the ones missing from the query LRU in one embed_vectors call."""
+        texts = [self.normalize_query(text) for text in texts]
+        vectors = {}
+        for text in texts:
+            vector = self.queries.get(text)
+            if vector is not None:
+                vectors[text] = vector
+        self.query_hits += sum(text in vectors for text in texts)
+
+        misses = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if misses:
+            self.query_misses += len(misses)
+            for text, vector in zip(misses, self.embed_vectors(misses)):
+                vectors[text] = vector
+                self.queries.put(text, vector)
+
+        return [vectors[text] for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self.embed_vectors(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_query_vectors([text])[0].tolist()
+
+    def stats(self) -> dict:
+        disk = self.disk.stats()
+        lookups = self.memory_hits + disk["hits"] + self.misses
+        return {
+            "memory_entries": len(self.memory),
+            "memory_hits": self.memory_hits,
+            "disk_entries": disk["entries"],
+            "disk_hits": disk["hits"],
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + disk["hits"]) / lookups if lookups else 0.0,
+            "query_entries": len(self.queries),
+            "query_hits": self.query_hits,
+            "query_misses": self.query_misses,
+        }
+
+
+embeddings = CachedEmbeddings(model="text-embedding-3-small")
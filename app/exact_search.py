@@ -0,0 +1,465 @@
+import argparse
+import fcntl
+import os
+import random
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.core.metrics import LatencyStats
+
+
+class SearchStats:
+    """Latency and measured recall@k of every search strategy."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.recalls = {}  # strategy -> [sum of sampled recalls, samples]
+        self.lock = threading.Lock()
+
+    def add(self, strategy: str, seconds: float):
+        with self.lock:
+            latencies = self.latencies.setdefault(strategy, LatencyStats())
+        latencies.add(seconds)
+
+    def add_recall(self, strategy: str, recall: float):
+        with self.lock:
+            total = self.recalls.setdefault(strategy, [0.0, 0])
+            total[0] += recall
+            total[1] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            strategies = dict(self.latencies)
+            recalls = {strategy: list(total) for strategy, total in self.recalls.items()}
+        result = {}
+        for strategy in strategies.keys() | recalls.keys():
+            result[strategy] = strategies[strategy].stats() if strategy in strategies else {"count": 0}
+            if strategy in recalls:
+                total, samples = recalls[strategy]
+                result[strategy]["recall"] = total / samples
+                result[strategy]["recall_samples"] = samples
+        return result
+
+
+search_stats = SearchStats()
+
+
+class Quantizer:
+    """Compact codes of unit vectors, scanned to pick the candidates rescored in full precision."""
+
+    name = None
+
+    def bytes_per_vector(self, dim: int) -> int:
+        raise NotImplementedError
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Codes of unit vectors, one row of bytes_per_vector bytes per vector."""
+        raise NotImplementedError
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray, dim: int) -> np.ndarray:
+        """Approximate similarity of every query to every coded row, higher is closer."""
+        raise NotImplementedError
+
+
+class Int8Quantizer(Quantizer):
+    """Scalar quantization: every vector scaled to [-127, 127] by its largest component, 4x smaller."""
+
+    name = "int8"
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return 4 + dim
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127
+        scales[scales == 0] = 1.0
+        codes = np.empty((len(vectors), 4 + vectors.shape[1]), dtype=np.uint8)
+        codes[:, :4] = scales.astype(np.float32).view(np.uint8)
+        codes[:, 4:] = np.round(vectors / scales).astype(np.int8).view(np.uint8)
+        return codes
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray, dim: int) -> np.ndarray:
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), QUANTIZED_BLOCK_ROWS):
+            # Dequantized block by block, so only QUANTIZED_BLOCK_ROWS float rows exist at a time
+            block = np.ascontiguousarray(codes[start:start + QUANTIZED_BLOCK_ROWS])
+            scales = block[:, :4].copy().view(np.float32)[:, 0]
+            values = block[:, 4:].view(np.int8).astype(np.float32)
+            scores[:, start:start + len(block)] = (queries @ values.T) * scales
+        return scores
+
+
+class BinaryQuantizer(Quantizer):
+    """1-bit quantization: the sign of every component, 32x smaller, compared by Hamming distance."""
+
+    name = "binary"
+    popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return (dim + 7) // 8
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors > 0, axis=1)
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray, dim: int) -> np.ndarray:
+        bits = self.encode(queries)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), QUANTIZED_BLOCK_ROWS):
+            block = np.asarray(codes[start:start + QUANTIZED_BLOCK_ROWS])
+            for i, query in enumerate(bits):
+                scores[i, start:start + len(block)] = -self.popcount[block ^ query].sum(axis=1, dtype=np.int32)
+        return scores
+
+
+QUANTIZED_BLOCK_ROWS = 16384
+QUANTIZERS = {quantizer.name: quantizer for quantizer in (Int8Quantizer, BinaryQuantizer)}
+
+
+def get_quantizer(name: str) -> Optional[Quantizer]:
+    if name == "none":
+        return None
+    if name not in QUANTIZERS:
+        raise ValueError(f"Unknown vector quantization {name}, expected none or one of {', '.join(QUANTIZERS)}")
+    return QUANTIZERS[name]()
+
+
+class ExactIndex:
+    """Unit-normalized float32 matrix of the chunk vectors of every small space, searched by brute force.
+
+    A space is stored as append-only files: space_{id}.f32, the raw rows, memory-mapped
+    for searches, and space_{id}.ids, its embedding dimension then one chunk id per row. Rows
+    are appended as chunks are written, so ingestion never rewrites the matrix; deletes do.
+    A space is tracked only if its matrix holds every vector of the space: spaces created
+    before the index existed, or grown beyond max_vectors, get a space_{id}.hnsw marker and
+    are searched by Chroma until `python -m app.exact_search --rebuild`.
+
+    With a quantizer, space_{id}.{quantizer name} holds the codes of the rows. Searches scan
+    the codes and rescore the best k * rescore candidates with their full-precision rows, so
+    only those rows of the float32 file are read. Spaces without codes, written before the
+    quantizer was configured, are scanned in full precision.
+
+    Writes to a space hold its space_{id}.lock file lock, so the server and the bulk CLI can
+    append to the same space; searches read without it.
+    """
+
+    def __init__(self, path: str, max_vectors: int, quantizer: Optional[Quantizer] = None, rescore: int = 10):
+        self.path = path
+        self.max_vectors = max_vectors
+        self.quantizer = quantizer
+        self.rescore = rescore
+        self.spaces = {}  # space_id -> (file sizes, ids, matrix, codes)
+        self.known = {}  # space_id -> ((inode, size) of the ids file, dimension, ids of the rows, row count), for appends
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def files(self, space_id: int) -> Tuple[str, str, str]:
+        prefix = os.path.join(self.path, f"space_{int(space_id)}")
+        return f"{prefix}.f32", f"{prefix}.ids", f"{prefix}.hnsw"
+
+    @contextmanager
+    def file_lock(self, space_id: int):
+        """Serializes the writes of a space across processes."""
+        with open(os.path.join(self.path, f"space_{int(space_id)}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def codes_file(self, space_id: int) -> Optional[str]:
+        if self.quantizer is None:
+            return None
+        return os.path.join(self.path, f"space_{int(space_id)}.{self.quantizer.name}")
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    def load(self, space_id: int) -> Optional[Tuple[List[str], np.ndarray, Optional[np.ndarray]]]:
+        """Returns the ids, matrix and codes (None without quantizer) of a tracked space,
+        None if the space is searched by Chroma."""
+        vectors_file, ids_file, _ = self.files(space_id)
+        codes_file = self.codes_file(space_id)
+        try:
+            sizes = (os.path.getsize(vectors_file), os.path.getsize(ids_file))
+        except FileNotFoundError:
+            return None
+        if codes_file and os.path.exists(codes_file):
+            sizes += (os.path.getsize(codes_file),)
+        with self.lock:
+            cached = self.spaces.get(space_id)
+            if cached and cached[0] == sizes:
+                return cached[1:]
+        # The files were written by this or another process since they were loaded
+        with open(ids_file) as f:
+            lines = f.read().split("\n")
+        # The last line is empty, or an id being appended
+        dim, ids = int(lines[0]), [chunk_id for chunk_id in lines[1:-1] if chunk_id]
+        codes = None
+        if not ids:
+            matrix = np.empty((0, dim), dtype=np.float32)
+        else:
+            # Rows are appended before their ids, the matrix may be ahead of the ids but never behind
+            matrix = np.memmap(vectors_file, dtype=np.float32, mode="r")[:len(ids) * dim].reshape(len(ids), dim)
+            if len(sizes) == 3:
+                width = self.quantizer.bytes_per_vector(dim)
+                if sizes[2] >= len(ids) * width:
+                    codes = np.memmap(codes_file, dtype=np.uint8, mode="r")[:len(ids) * width].reshape(len(ids), width)
+        with self.lock:
+            self.spaces[space_id] = (sizes, ids, matrix, codes)
+        return ids, matrix, codes
+
+    def add(self, space_id: int, ids: List[str], vectors, stored_count: Callable[[], int]):
+        """Appends the rows of newly written chunks of a space.
+
+        Args:
+            stored_count: returns the number of vectors of the space in Chroma, these ones included,
+                called once per space to check that the matrix will hold the whole space.
+        Vectors must have the dimension of the rows already stored, otherwise the space is untracked.
+        """
+        if not ids or not self.max_vectors:
+            return
+        vectors_file, ids_file, marker = self.files(space_id)
+        codes_file = self.codes_file(space_id)
+        with self.lock, self.file_lock(space_id):
+            if os.path.exists(marker):
+                return
+            if not os.path.exists(ids_file):
+                if stored_count() != len(ids):
+                    self.untrack(space_id, "it was created before the exact index")
+                    return
+                with open(ids_file, "w") as f:
+                    f.write(f"{len(vectors[0])}\n")
+                open(vectors_file, "wb").close()
+                if codes_file:
+                    open(codes_file, "wb").close()
+            stat = os.stat(ids_file)
+            cached = self.known.get(space_id)
+            if cached is None or cached[0] != (stat.st_ino, stat.st_size):
+                # Appended or rewritten by another process
+                cached = ((stat.st_ino, stat.st_size), *self.read_ids(ids_file))
+            _, dim, known, count = cached
+            if len(vectors[0]) != dim:
+                self.untrack(space_id, f"its {dim}-dimension rows can't take {len(vectors[0])}-dimension vectors")
+                return
+            rows = [(chunk_id, vector) for chunk_id, vector in zip(ids, vectors) if chunk_id not in known]
+            if len(known) + len(rows) > self.max_vectors:
+                self.untrack(space_id, f"it holds more than {self.max_vectors} vectors")
+                return
+            if not rows:
+                return
+            matrix = self.normalize([vector for _, vector in rows])
+            # Rows appended by a write that failed before its ids would shift the new ones
+            self.append(vectors_file, count * dim * 4, matrix.tobytes())
+            # Spaces written before the quantizer was configured get their codes on --rebuild
+            if codes_file and os.path.exists(codes_file):
+                self.append(codes_file, count * self.quantizer.bytes_per_vector(dim), self.quantizer.encode(matrix).tobytes())
+            with open(ids_file, "a") as f:
+                f.write("".join(f"{chunk_id}\n" for chunk_id, _ in rows))
+            known.update(chunk_id for chunk_id, _ in rows)
+            stat = os.stat(ids_file)
+            self.known[space_id] = ((stat.st_ino, stat.st_size), dim, known, count + len(rows))
+
+    @staticmethod
+    def append(file: str, size: int, data: bytes):
+        """Writes data at the given size of the file, dropping anything after it."""
+        with open(file, "r+b") as f:
+            f.truncate(size)
+            f.seek(size)
+            f.write(data)
+
+    @staticmethod
+    def read_ids(ids_file: str) -> Tuple[int, set, int]:
+        """Returns the dimension, the ids and the row count of a space."""
+        with open(ids_file) as f:
+            lines = f.read().split("\n")
+        ids = [line for line in lines[1:-1] if line]
+        return int(lines[0]), set(ids), len(ids)
+
+    def untrack(self, space_id: int, reason: str):
+        vectors_file, ids_file, marker = self.files(space_id)
+        for file in (vectors_file, ids_file, self.codes_file(space_id)):
+            if file and os.path.exists(file):
+                os.remove(file)
+        open(marker, "w").close()
+        self.spaces.pop(space_id, None)
+        self.known.pop(space_id, None)
+        logger.info(f"Space {space_id} is searched by HNSW, {reason}")
+
+    def delete(self, space_id: int, chunk_ids: List[str]):
+        """Removes rows of a tracked space, rewriting its files."""
+        if not chunk_ids:
+            return
+        with self.lock, self.file_lock(space_id):
+            loaded = self.load(space_id)
+            if not loaded:
+                return
+            deleted = set(chunk_ids)
+            ids, matrix, _ = loaded
+            keep = [row for row, chunk_id in enumerate(ids) if chunk_id not in deleted]
+            if len(keep) == len(ids):
+                return
+            self.write(space_id, [ids[row] for row in keep], matrix[keep], matrix.shape[1])
+
+    def write(self, space_id: int, ids: List[str], matrix: np.ndarray, dim: int):
+        vectors_file, ids_file, _ = self.files(space_id)
+        codes_file = self.codes_file(space_id)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        matrix.tofile(f"{vectors_file}.tmp")
+        if codes_file:
+            self.quantizer.encode(matrix).tofile(f"{codes_file}.tmp")
+        with open(f"{ids_file}.tmp", "w") as f:
+            f.write(f"{dim}\n" + "".join(f"{chunk_id}\n" for chunk_id in ids))
+        self.replace(space_id)
+
+    def replace(self, space_id: int):
+        """Moves the temporary files of a space in place, the matrix and codes first."""
+        vectors_file, ids_file, marker = self.files(space_id)
+        codes_file = self.codes_file(space_id)
+        os.replace(f"{vectors_file}.tmp", vectors_file)
+        if codes_file:
+            os.replace(f"{codes_file}.tmp", codes_file)
+        os.replace(f"{ids_file}.tmp", ids_file)
+        if os.path.exists(marker):
+            os.remove(marker)
+        self.spaces.pop(space_id, None)
+        self.known.pop(space_id, None)
+
+    def search(self, space_id: int, vectors, k: int, full: bool = False) -> Optional[Tuple[str, List[List[Tuple[str, float]]]]]:
+        """k nearest chunks of every vector as (chunk_id, cosine distance), nearest first.
+
+        Args:
+            full: scan the full-precision rows even if the space has codes.
+        Returns:
+            The strategy used (exact or exact-{quantizer}) and the results, None if the space is not tracked.
+        """
+        loaded = self.load(space_id)
+        if loaded is None:
+            return None
+        ids, matrix, codes = loaded
+        # Rows may hold only the leading dimensions of the query vectors, see app.matryoshka
+        queries = self.normalize(np.asarray(vectors, dtype=np.float32)[:, :matrix.shape[1]])
+        if not ids:
+            return "exact", [[] for _ in queries]
+        k = min(k, len(ids))
+        if codes is None or full:
+            return "exact", [self.nearest(ids, 1.0 - matrix @ query, k) for query in queries]
+
+        scores = self.quantizer.scores(codes, queries, matrix.shape[1])
+        candidates = min(len(ids), k * self.rescore)
+        results = []
+        for query, row in zip(queries, scores):
+            # Sorted, so the full-precision rows are read in file order
+            rows = np.sort(np.argpartition(-row, candidates - 1)[:candidates])
+            distances = 1.0 - matrix[rows] @ query
+            results.append([(ids[rows[i]], distance) for i, distance in self.nearest(range(len(rows)), distances, k)])
+        return f"exact-{self.quantizer.name}", results
+
+    @staticmethod
+    def nearest(ids, distances: np.ndarray, k: int) -> List[Tuple]:
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [(ids[i], float(distances[i])) for i in nearest]
+
+    def rebuild(self, collection, full_vectors=None):
+        """Rewrites the matrices of every space of a Chroma collection from its stored vectors.
+
+        Args:
+            full_vectors: with ANN_DIMENSIONS, the store of the full vectors, which the rows are read
+                from instead of Chroma's truncated ones. Spaces with chunks missing there are untracked.
+        """
+        counts = {}
+        incomplete = set()
+        offset = 0
+        while True:
+            results = collection.get(include=["embeddings", "metadatas"], limit=settings.CHROMA_BATCH_SIZE, offset=offset)
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+            groups = {}
+            for chunk_id, vector, metadata in zip(results["ids"], results["embeddings"], results["metadatas"]):
+                if metadata and metadata.get("space_id") is not None:
+                    groups.setdefault(metadata["space_id"], []).append((chunk_id, vector))
+            # Streamed to temporary files, only the current page is held in memory
+            for space_id, rows in groups.items():
+                if full_vectors is not None:
+                    full = full_vectors.get(space_id, [chunk_id for chunk_id, _ in rows])
+                    if len(full) < len(rows):
+                        incomplete.add(space_id)
+                    rows = [(chunk_id, full[chunk_id]) for chunk_id, _ in rows if chunk_id in full]
+                    if not rows:
+                        counts.setdefault(space_id, 0)
+                        continue
+                vectors_file, ids_file, _ = self.files(space_id)
+                codes_file = self.codes_file(space_id)
+                if space_id not in counts:
+                    counts[space_id] = 0
+                    open(f"{vectors_file}.tmp", "wb").close()
+                    if codes_file:
+                        open(f"{codes_file}.tmp", "wb").close()
+                    with open(f"{ids_file}.tmp", "w") as f:
+                        f.write(f"{len(rows[0][1])}\n")
+                counts[space_id] += len(rows)
+                if counts[space_id] > self.max_vectors or space_id in incomplete:
+                    continue
+                matrix = self.normalize([vector for _, vector in rows])
+                with open(f"{vectors_file}.tmp", "ab") as f:
+                    f.write(matrix.tobytes())
+                if codes_file:
+                    with open(f"{codes_file}.tmp", "ab") as f:
+                        f.write(self.quantizer.encode(matrix).tobytes())
+                with open(f"{ids_file}.tmp", "a") as f:
+                    f.write("".join(f"{chunk_id}\n" for chunk_id, _ in rows))
+        with self.lock:
+            for space_id, count in counts.items():
+                vectors_file, ids_file, marker = self.files(space_id)
+                with self.file_lock(space_id):
+                    if count > self.max_vectors or space_id in incomplete:
+                        for file in (vectors_file, ids_file, self.codes_file(space_id)):
+                            if file and os.path.exists(f"{file}.tmp"):
+                                os.remove(f"{file}.tmp")
+                        reason = "some of its full vectors are missing" if space_id in incomplete else f"it holds more than {self.max_vectors} vectors"
+                        self.untrack(space_id, reason)
+                        continue
+                    self.replace(space_id)
+                logger.info(f"Space {space_id}: {count} vectors")
+
+
+exact_index = ExactIndex(
+    os.path.join(settings.VECTORDB_PERSIST_DIR, "exact"),
+    settings.EXACT_SEARCH_MAX_VECTORS,
+    get_quantizer(settings.VECTOR_QUANTIZATION),
+    settings.QUANTIZATION_RESCORE,
+)
+
+
+def sample_recall() -> bool:
+    """Whether an exact search is also run through HNSW to measure its recall."""
+    return random.random() < settings.EXACT_SEARCH_RECALL_SAMPLE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the exact search matrices of the small spaces.")
+    parser.add_argument("--rebuild", action="store_true", help="rewrite the matrices from the vectors stored in Chroma")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from app.partitions import partitions
+
+        from app.matryoshka import full_vectors
+
+        # With ANN_DIMENSIONS Chroma holds truncated vectors, the rows come from the full vector store
+        for collection in partitions.all():
+            exact_index.rebuild(collection, full_vectors)
+    tracked = sorted(name for name in os.listdir(exact_index.path) if name.endswith(".ids"))
+    print(f"{len(tracked)} spaces searched exactly in {exact_index.path}")
+
+
+if __name__ == "__main__":
+    main()
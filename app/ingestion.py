@@ -0,0 +1,232 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from queue import Queue
+from typing import BinaryIO, Optional
+from uuid import uuid4
+
+from loguru import logger
+
+from app.answer_cache import answer_cache
+from app.contextual_vectordb import context_vectordb
+from app.core.config import settings
+from app.db.document import DocumentsService
+from app.db.document_chunk import DocumentChunksService
+from app.vectordb import vectordb
+
+
+def store_pdf(fileobj: BinaryIO) -> (str, str):
+    """Streams a file to PDF_DIR while hashing it, and stores it under its SHA-256.
+    Returns:
+        stored file path, SHA-256 of the content.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=settings.PDF_DIR, suffix=".part", delete=False) as buffer:
+        while chunk := fileobj.read(1024 * 1024):
+            digest.update(chunk)
+            buffer.write(chunk)
+    content_hash = digest.hexdigest()
+    file_path = os.path.join(settings.PDF_DIR, f"{content_hash}.pdf")
+    # Same name means same content, so replacing an existing copy is harmless
+    os.replace(buffer.name, file_path)
+    return file_path, content_hash
+
+
+class Job:
+    """Progress counters and timing shared by the ingestion jobs."""
+
+    def __init__(self):
+        self.id = str(uuid4())
+        self.status = "queued"
+        self.pages_parsed = 0
+        self.chunks_contextualized = 0
+        self.vectors_written = 0
+        self.tokens_embedded = 0
+        self.error = None
+
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started_at:
+            return 0.0
+        return ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.vectors_written / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens_embedded / self.elapsed if self.elapsed else 0.0
+
+    def progress(self, counter: str, n: int = 1):
+        """Advances one of the progress counters (pages_parsed, chunks_contextualized, vectors_written, tokens_embedded)."""
+        setattr(self, counter, getattr(self, counter) + n)
+
+    def run(self, queue: "IngestionQueue"):
+        raise NotImplementedError
+
+
+class IngestionJob(Job):
+    """Progress and outcome of one PDF ingestion."""
+
+    def __init__(self, file_path: str, space_id: int, document_id: int, advance: bool = True,
+                 source_document_id: Optional[int] = None, replace: bool = False,
+                 source_space_id: Optional[int] = None, title: Optional[str] = None,
+                 content_hash: Optional[str] = None):
+        super().__init__()
+        self.file_path = file_path
+        self.space_id = space_id
+        self.document_id = document_id
+        self.advance = advance
+        self.source_document_id = source_document_id  # Earlier upload of the same file
+        self.source_space_id = source_space_id
+        self.replace = replace  # New revision of an already ingested document
+        # File name and SHA-256 of the new revision, set on the document once it is ingested
+        self.title = title
+        self.content_hash = content_hash
+        self.chunks_reused = 0
+
+    @staticmethod
+    def existing_chunks(db, chunk_service: DocumentChunksService, space_id: int, document_id: int) -> dict:
+        existing = chunk_service.get_chunk_ids_by_hash(document_id)
+        # Documents ingested before the chunk registry existed are read back from the vector store
+        return existing or db.stored_chunks(space_id, document_id)
+
+    def run(self, queue: "IngestionQueue"):
+        db = context_vectordb if self.advance else vectordb
+        chunk_service = DocumentChunksService()
+        existing = {}
+        try:
+            if self.replace:
+                existing = self.existing_chunks(db, chunk_service, self.space_id, self.document_id)
+            records = []
+            # A source still being ingested has partial vectors, embed the file instead
+            if self.source_document_id and not queue.is_ingesting(self.source_document_id):
+                records = db.copy_document(
+                    self.source_document_id, self.space_id, self.document_id,
+                    progress=self.progress, source_space_id=self.source_space_id
+                )
+            if not records:
+                records = db.embed_docs(
+                    self.file_path, self.space_id, self.document_id, progress=self.progress, existing=existing
+                )
+
+            previous = {chunk_id for chunk_ids in existing.values() for chunk_id in chunk_ids}
+            current = {chunk_id for chunk_id, _ in records}
+            self.chunks_reused = len(previous & current)
+            db.delete_chunks(self.space_id, list(previous - current))
+            chunk_service.set_chunks(self.document_id, records)
+            if self.replace:
+                # A failed revision keeps the hash of the file its vectors come from, so uploads are not deduplicated against it
+                DocumentsService().update_document_file(self.document_id, self.title, self.content_hash)
+        except Exception:
+            # Drop the partially written vectors, a replaced document keeps its previous revision
+            try:
+                db.delete_document(self.space_id, self.document_id, keep=[i for ids in existing.values() for i in ids])
+            except Exception as cleanup_error:
+                logger.error(f"Cleanup of ingestion job {self.id} failed: {cleanup_error}")
+            raise
+
+
+class IngestionQueue:
+    """In-process job queue drained by a fixed pool of ingestion worker threads.
+
+    Jobs live in memory only: queued jobs are lost on restart, while the uploaded
+    file and its Document row are already persisted by the time a job is submitted.
+    """
+
+    def __init__(self, num_workers: int, max_jobs: int):
+        self.queue = Queue()
+        self.jobs = OrderedDict()
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+
+        for i in range(max(1, num_workers)):
+            worker = threading.Thread(target=self.work, name=f"ingestion-{i}", daemon=True)
+            worker.start()
+
+    def submit(self, file_path: str, space_id: int, document_id: int, advance: bool = True,
+               source_document_id: Optional[int] = None, replace: bool = False,
+               source_space_id: Optional[int] = None, title: Optional[str] = None,
+               content_hash: Optional[str] = None) -> IngestionJob:
+        """Registers a job and hands it over to the workers.
+        Args:
+            source_document_id: document already ingested from the same file, its vectors are reused.
+            source_space_id: space of the source document.
+            replace: the file is a new revision of the document, only its changed chunks are embedded.
+            title: file name of the new revision.
+            content_hash: SHA-256 of the new revision.
+        Returns:
+            IngestionJob: the queued job.
+        """
+        job = IngestionJob(
+            file_path, space_id, document_id, advance, source_document_id, replace, source_space_id, title, content_hash
+        )
+        self.submit_job(job)
+        logger.info(f"Queued ingestion job {job.id} for document {document_id}")
+        return job
+
+    def submit_job(self, job: Job) -> Job:
+        with self.lock:
+            self.jobs[job.id] = job
+            self.evict()
+        self.queue.put(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def is_ingesting(self, document_id: int) -> bool:
+        with self.lock:
+            return any(
+                getattr(job, "document_id", None) == document_id and not job.finished
+                for job in self.jobs.values()
+            )
+
+    def evict(self):
+        # Drop the oldest finished jobs once the registry is full; unfinished jobs are always kept
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:excess]:
+            del self.jobs[job_id]
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.run(job)
+            finally:
+                self.queue.task_done()
+
+    def run(self, job: Job):
+        job.status = "running"
+        job.started_at = datetime.now()
+        try:
+            job.run(self)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now()
+            # Answers cached while the documents of the space were changing are stale
+            answer_cache.invalidate(job.space_id)
+            with self.lock:
+                self.evict()
+
+
+ingestion_queue = IngestionQueue(settings.INGESTION_WORKERS, settings.INGESTION_MAX_JOBS)
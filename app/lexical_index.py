@@ -0,0 +1,178 @@
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from app.chunk_store import chunk_store
+from app.core.config import settings
+
+SQLITE_MAX_VARIABLES = 500
+# Part numbers and identifiers like "AB-1234" or "max_tokens" stay single tokens
+TOKENIZER = "unicode61 tokenchars '-_'"
+TERM = re.compile(r"[\w\-]+")
+
+
+class LexicalIndex:
+    """BM25 inverted index of the chunks, one SQLite FTS5 table per space.
+
+    Lives next to the Chroma files, opening it does not load anything in memory. The
+    `chunks` table maps chunk ids to the FTS row of their space, for deletes by chunk id
+    or document id.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, space_id INTEGER NOT NULL, document_id INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id)")
+        self.conn.commit()
+        self.spaces = {
+            row[0] for row in self.conn.execute("SELECT DISTINCT space_id FROM chunks").fetchall()
+        }
+
+    @staticmethod
+    def table(space_id: int) -> str:
+        return f"space_{int(space_id)}"
+
+    @staticmethod
+    def chunked(values: list) -> Iterable[list]:
+        for i in range(0, len(values), SQLITE_MAX_VARIABLES):
+            yield values[i:i + SQLITE_MAX_VARIABLES]
+
+    def has_space(self, space_id: int) -> bool:
+        """Whether the space has a table, which the bulk CLI or another worker may have created since startup."""
+        if space_id in self.spaces:
+            return True
+        with self.lock:
+            found = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table(space_id),)
+            ).fetchone()
+            if found:
+                self.spaces.add(space_id)
+        return found is not None
+
+    def add(self, rows: List[Tuple[str, int, int, str]]):
+        """Indexes (chunk_id, space_id, document_id, text) rows, replacing chunks already indexed."""
+        if not rows:
+            return
+        with self.lock:
+            self._delete([chunk_id for chunk_id, _, _, _ in rows])
+            for chunk_id, space_id, document_id, text in rows:
+                if space_id not in self.spaces:
+                    self.conn.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table(space_id)} USING fts5(text, tokenize=\"{TOKENIZER}\")"
+                    )
+                    self.spaces.add(space_id)
+                row_id = self.conn.execute(
+                    "INSERT INTO chunks (chunk_id, space_id, document_id) VALUES (?, ?, ?)",
+                    (chunk_id, space_id, document_id)
+                ).lastrowid
+                self.conn.execute(f"INSERT INTO {self.table(space_id)} (rowid, text) VALUES (?, ?)", (row_id, text))
+            self.conn.commit()
+
+    def add_documents(self, docs):
+        """Indexes langchain Documents carrying their id and space_id/document_id metadata."""
+        self.add([
+            (doc.id, doc.metadata["space_id"], doc.metadata.get("document_id"), doc.page_content)
+            for doc in docs
+        ])
+
+    def _delete(self, chunk_ids: List[str]):
+        for chunk in self.chunked(chunk_ids):
+            rows = self.conn.execute(
+                f"SELECT id, space_id FROM chunks WHERE chunk_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for row_id, space_id in rows:
+                self.conn.execute(f"DELETE FROM {self.table(space_id)} WHERE rowid = ?", (row_id,))
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", [(row_id,) for row_id, _ in rows])
+
+    def delete(self, chunk_ids: List[str]):
+        if not chunk_ids:
+            return
+        with self.lock:
+            self._delete(list(chunk_ids))
+            self.conn.commit()
+
+    def delete_document(self, document_id: int, keep=()):
+        """Removes every chunk of a document except the ids in keep."""
+        keep = set(keep)
+        with self.lock:
+            chunk_ids = [
+                row[0] for row in
+                self.conn.execute("SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,)).fetchall()
+                if row[0] not in keep
+            ]
+            self._delete(chunk_ids)
+            self.conn.commit()
+
+    @staticmethod
+    def match_query(question: str) -> Optional[str]:
+        # Every term is quoted, so FTS5 operators and punctuation in questions are taken literally
+        terms = dict.fromkeys(term.lower() for term in TERM.findall(question))
+        return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms) or None
+
+    def search(self, space_id: int, question: str, k: int) -> List[Tuple[str, float]]:
+        """Returns the (chunk_id, bm25 score) of the k best chunks of the space, best first."""
+        query = self.match_query(question)
+        if not query or not self.has_space(space_id):
+            return []
+        table = self.table(space_id)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT chunks.chunk_id, bm25({table}) AS score FROM {table} "
+                f"JOIN chunks ON chunks.id = {table}.rowid "
+                f"WHERE {table} MATCH ? ORDER BY score LIMIT ?",
+                (query, k)
+            ).fetchall()
+        # FTS5 scores are negated BM25, lower is better
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def rebuild(self, collection):
+        """Indexes every chunk of a Chroma collection, for data written before the index existed."""
+        offset = 0
+        while True:
+            results = collection.get(include=["documents", "metadatas"], limit=settings.CHROMA_BATCH_SIZE, offset=offset)
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+            stored = chunk_store.get(results["ids"])
+            self.add([
+                (chunk_id, metadata["space_id"], metadata.get("document_id"), stored[chunk_id][0] if chunk_id in stored else text)
+                for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+                if metadata and metadata.get("space_id") is not None and (chunk_id in stored or text is not None)
+            ])
+            logger.info(f"Indexed {offset} chunks")
+
+
+lexical_index = LexicalIndex(os.path.join(settings.VECTORDB_PERSIST_DIR, "lexical_index.sqlite3"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the BM25 index of the chunks.")
+    parser.add_argument("--rebuild", action="store_true", help="reindex every chunk stored in Chroma")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from app.partitions import partitions
+
+        for collection in partitions.all():
+            lexical_index.rebuild(collection)
+    print(f"{lexical_index.count()} chunks indexed in {lexical_index.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.exact_search import ExactIndex
+
+
+def truncate(vectors, dimensions: int) -> np.ndarray:
+    """Leading dimensions of the vectors, renormalized.
+
+    text-embedding-3 vectors are trained so that this equals embedding with `dimensions`,
+    so one full-size embedding serves both the ANN index and the rescoring.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    vectors = vectors[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class FullVectors(ExactIndex):
+    """Full-dimension vectors of every chunk when Chroma only holds their first ANN_DIMENSIONS.
+
+    Same append-only per-space files as the exact index, without a size limit. Rows are read
+    back by chunk id, from the memory-mapped file, to rescore the candidates of a search.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, sys.maxsize)
+        self.positions = {}  # space_id -> (ids of the loaded files, chunk_id -> row)
+
+    def get(self, space_id: int, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Full vectors of the chunks of a space, chunks without one are left out."""
+        loaded = self.load(space_id)
+        if loaded is None:
+            return {}
+        ids, matrix, _ = loaded
+        with self.lock:
+            cached = self.positions.get(space_id)
+            if cached is None or cached[0] is not ids:
+                cached = (ids, {chunk_id: row for row, chunk_id in enumerate(ids)})
+                self.positions[space_id] = cached
+        rows = sorted((cached[1][chunk_id], chunk_id) for chunk_id in set(chunk_ids) if chunk_id in cached[1])
+        if not rows:
+            return {}
+        vectors = matrix[[row for row, _ in rows]]
+        return {chunk_id: vector for (_, chunk_id), vector in zip(rows, vectors)}
+
+
+full_vectors = FullVectors(os.path.join(settings.VECTORDB_PERSIST_DIR, "full")) if settings.ANN_DIMENSIONS else None
+
+
+def migrate(source: str) -> int:
+    """Copies the collections named after `source` to the current ones, truncating their vectors.
+
+    Ids, texts and metadata are kept, so the BM25 and exact indexes stay valid. Chunks whose
+    text is in the chunk store have no document in Chroma and are copied without one.
+    Returns:
+        int: number of copied vectors.
+    """
+    from app.partitions import partitions
+
+    if full_vectors is None:
+        raise ValueError("Set ANN_DIMENSIONS to migrate")
+    if source == settings.COLLECTION_NAME:
+        raise ValueError("Set COLLECTION_NAME to the new collection, the source one keeps the full vectors")
+    names = [source]
+    if partitions.partitioned:
+        prefix = f"{source}-{partitions.mode}-"
+        names = [name for name in partitions.client.list_collections() if name.startswith(prefix)]
+    copied = 0
+    for name in names:
+        collection = partitions.client.get_collection(name, embedding_function=None)
+        offset = 0
+        while True:
+            results = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=settings.CHROMA_BATCH_SIZE,
+                offset=offset,
+            )
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+            groups = {}
+            for row in zip(results["ids"], results["embeddings"], results["documents"], results["metadatas"]):
+                groups.setdefault(row[3]["space_id"], []).append(row)
+            for space_id, rows in groups.items():
+                for with_text in (True, False):
+                    selected = [row for row in rows if (row[2] is not None) == with_text]
+                    if not selected:
+                        continue
+                    ids, vectors, texts, metadatas = (list(column) for column in zip(*selected))
+                    partitions.collection(space_id).upsert(
+                        ids=ids,
+                        embeddings=list(truncate(vectors, settings.ANN_DIMENSIONS)),
+                        metadatas=metadatas,
+                        **({"documents": texts} if with_text else {}),
+                    )
+                ids, vectors = [row[0] for row in rows], [row[1] for row in rows]
+                full_vectors.add(space_id, ids, vectors, lambda: partitions.count(space_id))
+            copied += len(results["ids"])
+            logger.info(f"Migrated {copied} vectors from {name}")
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move full-size vectors to a truncated ANN index and the full vector store.")
+    parser.add_argument("--migrate", metavar="SOURCE_COLLECTION", help="collection holding the full vectors")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Copied {migrate(args.migrate)} vectors, {settings.ANN_DIMENSIONS} dimensions in {settings.COLLECTION_NAME}")
+
+
+if __name__ == "__main__":
+    main()
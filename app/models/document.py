@@ -25,6 +25,7 @@ class Document(BareBaseModel):
         nullable=False
     )
     title = Column(String)
+    content_hash = Column(String, index=True)  # SHA-256 of the uploaded file
     uploaded_date = Column(
         DateTime,
         default=datetime.now,
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, ForeignKey
+
+from app.models.base import BareBaseModel
+
+
+class DocumentChunk(BareBaseModel):
+    """Document chunk database model, maps a document to its vectors."""
+    __tablename__ = 'document_chunks'
+    id = Column(Integer, primary_key=True)
+    document_id = Column(
+        Integer,
+        ForeignKey('documents.id'),
+        nullable=False,
+        index=True
+    )
+    chunk_id = Column(String, nullable=False, unique=True)  # Id of the vector in the vector store
+    content_hash = Column(String, nullable=False)  # SHA-256 of the chunk text
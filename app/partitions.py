@@ -0,0 +1,156 @@
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from loguru import logger
+
+from app.core.config import settings
+
+
+def create_client() -> chromadb.ClientAPI:
+    chroma_settings = ChromaSettings(anonymized_telemetry=False)
+    if settings.VECTORDB_MEMORY_LIMIT:
+        # Chroma unloads the least recently used HNSW indexes beyond the limit
+        chroma_settings.chroma_segment_cache_policy = "LRU"
+        chroma_settings.chroma_memory_limit_bytes = settings.VECTORDB_MEMORY_LIMIT
+    return chromadb.PersistentClient(path=settings.VECTORDB_PERSIST_DIR, settings=chroma_settings)
+
+
+class Partitions:
+    """Routes every space to the Chroma collection holding its vectors.
+
+    VECTORDB_PARTITION selects the layout:
+        - none: every space in the COLLECTION_NAME collection, searches filter on space_id
+        - space: one collection per space, searches need no filter
+        - workspace: one collection per workspace, searches filter on space_id
+    Collections are opened on first use and at most VECTORDB_OPEN_PARTITIONS handles are kept,
+    least recently used first out.
+    """
+
+    def __init__(self, client: chromadb.ClientAPI, mode: str, max_open: int):
+        if mode not in ("none", "space", "workspace"):
+            raise ValueError(f"Unknown partition mode {mode}")
+        self.client = client
+        self.mode = mode
+        self.max_open = max_open
+        self.collections = OrderedDict()
+        self.workspaces = {}  # space_id -> workspace_id
+        self.lock = threading.Lock()
+
+    @property
+    def partitioned(self) -> bool:
+        return self.mode != "none"
+
+    def workspace_id(self, space_id: int) -> int:
+        if space_id not in self.workspaces:
+            from app.db.space import SpacesService
+
+            # Spaces never move to another workspace, so the mapping is cached for good
+            self.workspaces[space_id] = SpacesService().get_space_by_id(space_id).workspace_id
+        return self.workspaces[space_id]
+
+    def name(self, space_id: Optional[int]) -> str:
+        if self.mode == "none" or space_id is None:
+            return settings.COLLECTION_NAME
+        if self.mode == "space":
+            return f"{settings.COLLECTION_NAME}-space-{space_id}"
+        return f"{settings.COLLECTION_NAME}-workspace-{self.workspace_id(space_id)}"
+
+    def open(self, name: str):
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is not None:
+                self.collections.move_to_end(name)
+                return collection
+        collection = self.client.get_or_create_collection(
+            name, embedding_function=None, metadata=settings.COLLECTION_METADATA
+        )
+        with self.lock:
+            self.collections[name] = collection
+            while len(self.collections) > self.max_open:
+                self.collections.popitem(last=False)
+        return collection
+
+    def collection(self, space_id: Optional[int]):
+        """Collection holding the vectors of the space, the global collection if space_id is None."""
+        return self.open(self.name(space_id))
+
+    def where(self, space_id: Optional[int]) -> Optional[dict]:
+        """Metadata filter restricting a search of the space's collection to the space."""
+        if space_id is None or self.mode == "space":
+            return None
+        return {"space_id": space_id}
+
+    def count(self, space_id: int) -> int:
+        """Number of vectors stored for the space."""
+        collection = self.collection(space_id)
+        if self.mode == "space":
+            return collection.count()
+        return len(collection.get(where=self.where(space_id), include=[])["ids"])
+
+    def all(self) -> Iterator:
+        """Every collection holding vectors of the current layout."""
+        if not self.partitioned:
+            yield self.open(settings.COLLECTION_NAME)
+            return
+        prefix = f"{settings.COLLECTION_NAME}-{self.mode}-"
+        for name in self.client.list_collections():
+            if name.startswith(prefix):
+                yield self.open(name)
+
+    def migrate(self, delete_source: bool = False) -> int:
+        """Copies the vectors of the global collection to the partitions of the current layout.
+        Returns:
+            int: number of copied vectors.
+        """
+        if not self.partitioned:
+            raise ValueError("Set VECTORDB_PARTITION to space or workspace to migrate")
+        source = self.open(settings.COLLECTION_NAME)
+        copied = 0
+        offset = 0
+        while True:
+            results = source.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=settings.CHROMA_BATCH_SIZE,
+                offset=offset,
+            )
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+            groups = {}
+            for row in zip(results["ids"], results["embeddings"], results["documents"], results["metadatas"]):
+                groups.setdefault(self.name(row[3]["space_id"]), []).append(row)
+            for name, rows in groups.items():
+                ids, vectors, texts, metadatas = zip(*rows)
+                self.open(name).upsert(
+                    ids=list(ids), embeddings=list(vectors), documents=list(texts), metadatas=list(metadatas)
+                )
+            copied += len(results["ids"])
+            logger.info(f"Migrated {copied} vectors")
+        if delete_source:
+            self.client.delete_collection(settings.COLLECTION_NAME)
+            with self.lock:
+                self.collections.pop(settings.COLLECTION_NAME, None)
+        return copied
+
+
+partitions = Partitions(create_client(), settings.VECTORDB_PARTITION, settings.VECTORDB_OPEN_PARTITIONS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the vectors of the global collection to per-space or per-workspace collections.")
+    parser.add_argument("--migrate", action="store_true", help="copy the global collection to the partitions")
+    parser.add_argument("--delete-source", action="store_true", help="drop the global collection once copied")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Copied {partitions.migrate(args.delete_source)} vectors ({partitions.mode} partitions)")
+    for collection in partitions.all():
+        print(f"{collection.name}: {collection.count()} vectors")
+
+
+if __name__ == "__main__":
+    main()
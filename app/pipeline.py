@@ -0,0 +1,171 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from queue import Queue, Full
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.pdf_extraction import extract_pages, get_extractor
+
+T = TypeVar("T")
+
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1024,
+    chunk_overlap=20,
+    length_function=len,
+    separators=["\n\n", "\n", " "],
+)
+
+
+@lru_cache(maxsize=1)
+def get_page_pool() -> ProcessPoolExecutor:
+    # spawn, the ingestion workers run threads and must not be forked
+    return ProcessPoolExecutor(
+        max_workers=settings.PDF_PARSE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def ordered_map(executor: Executor, fn: Callable, items: Iterable[tuple], ahead: int) -> Iterator:
+    """Yields fn(*item) for every item in order, with at most ahead calls running on the executor."""
+    in_flight = deque()
+    try:
+        for item in items:
+            in_flight.append(executor.submit(fn, *item))
+            if len(in_flight) >= ahead:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_pages(file_path, progress=None, parallel=True) -> Iterator[Document]:
+    """Yields the PDF pages in order, extracted by PDF_BACKEND.
+
+    With parallel, ranges of PDF_PAGES_PER_TASK pages are extracted on the PDF_PARSE_WORKERS
+    process pool, a few ranges ahead of the consumer, so memory does not grow with the PDF.
+    """
+    extractor = get_extractor(settings.PDF_BACKEND)
+    if parallel and settings.PDF_PARSE_WORKERS > 1:
+        step = settings.PDF_PAGES_PER_TASK
+        ranges = [(extractor.name, file_path, start, start + step)
+                  for start in range(0, extractor.page_count(file_path), step)]
+        pages = chain.from_iterable(
+            ordered_map(get_page_pool(), extract_pages, ranges, ahead=2 * settings.PDF_PARSE_WORKERS)
+        )
+    else:
+        pages = extractor.pages(file_path)
+    for page in pages:
+        if progress:
+            progress("pages_parsed")
+        yield page
+
+
+def iter_chunks(pages: Iterable[Document]) -> Iterator[Document]:
+    # split_documents splits every page on its own, so splitting page by page gives the same chunks
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+def iter_windows(chunks: Iterable[Document], window_size: int = 3) -> Iterator[Tuple[str, Document]]:
+    """Pairs every chunk with the joined text of the window of chunks centered on it.
+
+    Only window_size chunks are held at a time, the window is clipped at both ends of the document.
+    """
+    before = window_size // 2
+    after = window_size - before - 1
+    buffer = deque()
+    current = 0  # position in buffer of the next chunk to emit
+
+    def emit():
+        window = list(islice(buffer, max(0, current - before), current + after + 1))
+        return " ".join(chunk.page_content for chunk in window), buffer[current]
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        if len(buffer) - 1 - current >= after:
+            yield emit()
+            current += 1
+            if current > before:
+                buffer.popleft()
+                current -= 1
+
+    while current < len(buffer):
+        yield emit()
+        current += 1
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+_DONE = object()
+
+
+def prefetch(iterable: Iterable[T], maxsize: int) -> Iterator[T]:
+    """Runs the iterable in a background thread, buffering at most maxsize items ahead of the consumer."""
+    queue = Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except Exception as e:
+            put((_DONE, e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is _DONE:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        # Unblocks the producer when the consumer stops early
+        stop.set()
+
+
+def parse_pdf(file_path) -> Tuple[int, List[Tuple[str, Document]]]:
+    """Parses a whole PDF into (window, chunk) pairs, meant to run in a worker process.
+
+    Pages are extracted serially, the callers already parse one file per process.
+    Returns:
+        number of pages, (window, chunk) pairs.
+    """
+    pages = 0
+
+    def count(counter, n=1):
+        nonlocal pages
+        pages += n
+
+    pairs = list(iter_windows(iter_chunks(iter_pages(file_path, count, parallel=False))))
+    return pages, pairs
@@ -39,7 +39,8 @@ class RAG:
     def retrieve(self, state: State):
         try:
             logger.info("Start Retrieve")
-            retrieved_docs = vectordb.retrieve(state["question"], space_id=state["space_id"])
+            # Texts are read by the reranker, for the chunks it needs
+            retrieved_docs = vectordb.retrieve(state["question"], space_id=state["space_id"], hydrate=False)
             if len(retrieved_docs) == 0:
                 return {"context": retrieved_docs}
             logger.info("Start Rerank")
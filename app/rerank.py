@@ -1,35 +1,56 @@
 import re
+import threading
 from typing import List
 
+import numpy as np
 from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
 from langchain_core.documents import Document
 from app.core.config import settings
+from app.embeddings import embeddings
+from app.matryoshka import truncate
+from app.vectordb import vectordb
 from loguru import logger
 
 
-@settings.timeit
-def rerank_results(query: str, results: List[Document], k: int = 5) -> List[Document]:
-    llm = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0.0,
-        max_tokens=64
-    )
-
-    summaries = []
-
-    for i, result in enumerate(results):
-        origin_content = result.metadata.get("origin_content")
-        contextualized_content = result.metadata.get("contextualized_content")
-        if origin_content and contextualized_content:
-            summary = f"[{i}] Document: {origin_content}\nContext: {contextualized_content}"
-        else:
-            summary = f"[{i}] Document: {result.page_content}"
+class Reranker:
+    """Picks the k most relevant of the retrieved documents, most relevant first."""
+
+    name = None
+    # Rerankers reading the texts get hydrated candidates, the others only hydrate the picked documents
+    needs_text = True
+
+    def rerank(self, query: str, results: List[Document], k: int = 5) -> List[Document]:
+        raise NotImplementedError
+
+
+class LLMReranker(Reranker):
+    """Asks gpt-4o-mini for the indices of the most relevant documents."""
 
-        summaries.append(summary)
-    joined_summaries = "\n\n".join(summaries)
+    name = "llm"
 
-    prompt = f"""
+    def __init__(self):
+        self.llm = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.0,
+            max_tokens=64
+        )
+
+    def rerank(self, query: str, results: List[Document], k: int = 5) -> List[Document]:
+        summaries = []
+
+        for i, result in enumerate(results):
+            origin_content = result.metadata.get("origin_content")
+            contextualized_content = result.metadata.get("contextualized_content")
+            if origin_content and contextualized_content:
+                summary = f"[{i}] Document: {origin_content}\nContext: {contextualized_content}"
+            else:
+                summary = f"[{i}] Document: {result.page_content}"
+
+            summaries.append(summary)
+        joined_summaries = "\n\n".join(summaries)
+
+        prompt = f"""
 Query: {query}
 You are about to be given a group of documents, each preceded by its index number in square brackets. Your task is to select the only {k} most relevant documents from the list to help us answer the query.
 
@@ -40,30 +61,224 @@ You are about to be given a group of documents, each preceded by its index numbe
 Output only the indices of {k} most relevant documents in order of relevance, separated by commas, enclosed in XML tags here:
 <relevant_indices>put the numbers of your indices here, seeparted by commas</relevant_indices>
 """
-    try:
-        mess = [
-            HumanMessage(content=prompt),
-        ]
-        response = llm.invoke(mess)
-
-        # Extract the indices from the response
-        match = re.search(r"<relevant_indices>(.*?)</relevant_indices>", response.content)
-        if match:
-            indices_str = match.group(1)
-            relevant_indices = list(map(int, indices_str.split(",")))
-        # If we didn't get enough valid indices, fall back to the top k by original order
+        try:
+            mess = [
+                HumanMessage(content=prompt),
+            ]
+            response = self.llm.invoke(mess)
+
+            # Extract the indices from the response
+            match = re.search(r"<relevant_indices>(.*?)</relevant_indices>", response.content)
+            if match:
+                indices_str = match.group(1)
+                relevant_indices = list(map(int, indices_str.split(",")))
+            # If we didn't get enough valid indices, fall back to the top k by original order
+            else:
+                relevant_indices = list(range(min(k, len(results))))
+
+            # Ensure we don't have out-of-range indices
+            relevant_indices = [idx for idx in relevant_indices if idx < len(results)]
+
+            # Return the reranked results
+            reranked_results = [results[idx] for idx in relevant_indices[:k]]
+
+            return reranked_results
+
+        except Exception as e:
+            logger.error(f"An error occurred during reranking: {str(e)}")
+            # Fall back to returning the top k results without reranking
+            return results[:k]
+
+
+class CrossEncoderReranker(Reranker):
+    """Scores (query, document) pairs with a local cross-encoder, in batches on the CPU.
+
+    RERANK_RUNTIME selects how the model runs:
+        - torch: transformers model in float32
+        - torch-int8: the same model with its Linear layers dynamically quantized to int8
+        - onnx: onnxruntime session over RERANK_ONNX_FILE of the model repository,
+          point it to one of the quantized exports for int8 inference
+    The model is loaded on first use.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model: str, runtime: str):
+        self.model_name = model
+        self.runtime = runtime
+        self.tokenizer = None
+        self.model = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.runtime == "onnx":
+            import onnxruntime
+            from huggingface_hub import hf_hub_download
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = settings.RERANK_THREADS
+            self.model = onnxruntime.InferenceSession(
+                hf_hub_download(self.model_name, settings.RERANK_ONNX_FILE),
+                options,
+                providers=["CPUExecutionProvider"],
+            )
+        elif self.runtime in ("torch", "torch-int8"):
+            import torch
+            from transformers import AutoModelForSequenceClassification
+
+            torch.set_num_threads(settings.RERANK_THREADS)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+            if self.runtime == "torch-int8":
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model = model
+        else:
+            raise ValueError(f"Unknown rerank runtime {self.runtime}")
+        # Set last, it marks the reranker as loaded
+        self.tokenizer = tokenizer
+        logger.info(f"Loaded reranker {self.model_name} ({self.runtime})")
+
+    def predict(self, query: str, texts: List[str]) -> np.ndarray:
+        if self.runtime == "onnx":
+            features = self.tokenizer(
+                [query] * len(texts), texts, padding=True, truncation=True,
+                max_length=settings.RERANK_MAX_LENGTH, return_tensors="np"
+            )
+            names = {model_input.name for model_input in self.model.get_inputs()}
+            logits = self.model.run(
+                None, {name: value.astype(np.int64) for name, value in features.items() if name in names}
+            )[0]
         else:
-            relevant_indices = list(range(min(k, len(results))))
+            import torch
+
+            features = self.tokenizer(
+                [query] * len(texts), texts, padding=True, truncation=True,
+                max_length=settings.RERANK_MAX_LENGTH, return_tensors="pt"
+            )
+            with torch.inference_mode():
+                logits = self.model(**features).logits.numpy()
+        # Relevance is the last label of the classification head
+        return logits.reshape(len(texts), -1)[:, -1]
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """Relevance score of every text for the query, higher is more relevant."""
+        if self.tokenizer is None:
+            with self.lock:
+                # A model that failed to load is not retried on every query
+                if self.error:
+                    raise RuntimeError(self.error)
+                if self.tokenizer is None:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        self.error = f"Could not load {self.model_name}: {e}"
+                        raise
+        return np.concatenate([
+            self.predict(query, texts[i:i + settings.RERANK_BATCH_SIZE])
+            for i in range(0, len(texts), settings.RERANK_BATCH_SIZE)
+        ])
+
+    def rerank(self, query: str, results: List[Document], k: int = 5) -> List[Document]:
+        scores = self.score(query, [result.page_content for result in results])
+        # Stable sort, ties keep the retrieval order
+        return [results[i] for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+class MMRReranker(Reranker):
+    """Maximal marginal relevance over the chunk vectors stored in Chroma, without any model call.
+
+    Every pick maximizes lambda * similarity(query, chunk) - (1 - lambda) * max similarity(chunk,
+    picked chunks), so near-duplicate chunks (overlapping chunks, shared context windows) are
+    not picked together. The question vector comes from the query embedding cache.
+    """
+
+    name = "mmr"
+    needs_text = False
+
+    def __init__(self, diversity_lambda: float):
+        self.diversity_lambda = diversity_lambda
 
-        # Ensure we don't have out-of-range indices
-        relevant_indices = [idx for idx in relevant_indices if idx < len(results)]
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
 
-        # Return the reranked results
-        reranked_results = [results[idx] for idx in relevant_indices[:k]]
+    def stored_vectors(self, results: List[Document]) -> np.ndarray:
+        ids = [result.id for result in results]
+        stored = vectordb.get_chunks(results[0].metadata.get("space_id"), ids, include=["embeddings"])
+        vectors = dict(zip(stored["ids"], stored["embeddings"]))
+        missing = [chunk_id for chunk_id in ids if chunk_id not in vectors]
+        if missing:
+            raise ValueError(f"No stored vectors for {len(missing)} of the documents")
+        return np.asarray([vectors[chunk_id] for chunk_id in ids], dtype=np.float32)
 
-        return reranked_results
+    def select(self, query_vector: np.ndarray, vectors: np.ndarray, k: int) -> List[int]:
+        """Indices of the k rows of vectors picked by MMR, in order of selection."""
+        vectors = self.normalize(vectors)
+        relevance = vectors @ self.normalize(query_vector)
+        similarity = vectors @ vectors.T
+        redundancy = np.full(len(vectors), -np.inf)
+        available = np.ones(len(vectors), dtype=bool)
+        picked = []
+        for _ in range(min(k, len(vectors))):
+            scores = relevance if not picked else (
+                self.diversity_lambda * relevance - (1 - self.diversity_lambda) * redundancy
+            )
+            best = int(np.argmax(np.where(available, scores, -np.inf)))
+            picked.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, similarity[best])
+        return picked
 
+    def rerank(self, query: str, results: List[Document], k: int = 5) -> List[Document]:
+        if not results:
+            return []
+        vectors = self.stored_vectors(results)
+        # With ANN_DIMENSIONS, Chroma holds the leading dimensions of the vectors
+        query_vector = truncate(embeddings.embed_query_vectors([query])[0], vectors.shape[1])
+        return [results[i] for i in self.select(query_vector, vectors, k)]
+
+
+RERANKERS = {}
+rerankers_lock = threading.Lock()
+
+
+def get_reranker(name: str) -> Reranker:
+    """Returns the shared reranker of the given name (llm, cross-encoder or mmr)."""
+    with rerankers_lock:
+        if name not in RERANKERS:
+            if name == LLMReranker.name:
+                RERANKERS[name] = LLMReranker()
+            elif name == CrossEncoderReranker.name:
+                RERANKERS[name] = CrossEncoderReranker(settings.RERANK_MODEL, settings.RERANK_RUNTIME)
+            elif name == MMRReranker.name:
+                RERANKERS[name] = MMRReranker(settings.RERANK_MMR_LAMBDA)
+            else:
+                raise ValueError(f"Unknown reranker {name}")
+        return RERANKERS[name]
+
+
+@settings.timeit
+def rerank_results(query: str, results: List[Document], k: int = 5, reranker: str = None) -> List[Document]:
+    """Reranks with RERANKER, falling back to the LLM reranker if the configured one fails.
+
+    Results retrieved without their text are hydrated before reranking when the reranker reads
+    the texts, else only the k picked ones are.
+    """
+    name = reranker or settings.RERANKER
+    try:
+        return rerank_hydrated(get_reranker(name), query, results, k)
     except Exception as e:
-        logger.error(f"An error occurred during reranking: {str(e)}")
-        # Fall back to returning the top k results without reranking
-        return results[:k]
+        if name == LLMReranker.name:
+            raise
+        logger.error(f"Reranker {name} failed, falling back to the LLM reranker: {e}")
+        return rerank_hydrated(get_reranker(LLMReranker.name), query, results, k)
+
+
+def rerank_hydrated(reranker: Reranker, query: str, results: List[Document], k: int) -> List[Document]:
+    if reranker.needs_text:
+        results = vectordb.hydrate(results)
+    return vectordb.hydrate(reranker.rerank(query, results, k))
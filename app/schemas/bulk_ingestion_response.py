@@ -0,0 +1,34 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+from datetime import datetime
+
+
+
+class BulkIngestionJobResponse(BaseModel):
+    """Bulk ingestion job response schema."""
+    id: str
+    space_id: int
+    status: str
+    files_total: int
+    files_ingested: int
+    files_deduplicated: int
+    files_failed: int
+    failed_files: List[str]
+    documents_created: int
+    pages_parsed: int
+    chunks_contextualized: int
+    vectors_written: int
+    tokens_embedded: int
+    files_per_second: float
+    pages_per_second: float
+    chunks_per_second: float
+    tokens_per_second: float
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+        use_enum_values = True
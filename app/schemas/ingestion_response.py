@@ -0,0 +1,29 @@
+from typing import Optional
+
+from pydantic import BaseModel
+from datetime import datetime
+
+
+
+class IngestionJobResponse(BaseModel):
+    """Ingestion job response schema."""
+    id: str
+    document_id: int
+    space_id: int
+    source_document_id: Optional[int] = None
+    status: str
+    pages_parsed: int
+    chunks_contextualized: int
+    vectors_written: int
+    tokens_embedded: int
+    chunks_reused: int
+    chunks_per_second: float
+    tokens_per_second: float
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+        use_enum_values = True
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+
+
+_private_api_missing = False
+
+
+def hnsw_index(collection):
+    """The hnswlib index loaded by Chroma for a local collection, None until it holds vectors.
+
+    Reaches into Chroma's private segment manager (pinned chromadb version). If those internals
+    are missing, e.g. with a client/server collection or another chromadb version, it logs once
+    and returns None: searches then run with the collection's search_ef instead of failing.
+    """
+    global _private_api_missing
+    if _private_api_missing:
+        return None
+    try:
+        from chromadb.segment import VectorReader
+
+        segment = collection._client._manager.get_segment(collection.id, VectorReader)
+        index = getattr(segment, "_index", None)
+        if index is not None and not hasattr(index, "set_ef"):
+            raise AttributeError("hnswlib index without set_ef")
+        return index
+    except Exception as e:
+        _private_api_missing = True
+        logger.warning(f"Per-query search_ef is disabled, the Chroma index cannot be reached: {e!r}")
+        return None
+
+
+class SearchParams:
+    """HNSW search_ef of every space, tuned by `python -m app.search_params --tune`.
+
+    Chroma fixes search_ef when it loads an index, so a search with another ef sets it on the
+    loaded hnswlib index for the duration of the query. Searches of a collection with the same
+    ef run concurrently. A search with another ef is queued, and searches arriving after it queue
+    behind it even with the running ef, so every ef gets its turn in arrival order. Searches with
+    different efs on one collection are therefore serialized: with VECTORDB_PARTITION=space every
+    index has a single ef and never waits, with a shared collection mixed efs cost throughput.
+    """
+
+    def __init__(self, path: str, default_ef: int):
+        self.path = path
+        self.default_ef = default_ef
+        self.spaces = {}  # space_id -> tuned settings
+        self.mtime = None
+        self.states = {}  # collection id -> {"ef": set on the index, "running": searches, "waiting": [ef, admitted] tickets}
+        self.condition = threading.Condition()
+
+    def tuned(self, space_id: Optional[int]) -> dict:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return {}
+        if mtime != self.mtime:
+            # Written by the tuner, possibly from another process
+            with open(self.path) as f:
+                self.spaces = json.load(f).get("spaces", {})
+            self.mtime = mtime
+        return self.spaces.get(str(space_id), {})
+
+    def search_ef(self, space_id: Optional[int], search_ef: Optional[int] = None) -> int:
+        """The ef of a search: the requested one, else the one tuned for the space, else the collection's."""
+        return search_ef or self.tuned(space_id).get("search_ef") or self.default_ef
+
+    @contextmanager
+    def applied(self, collection, ef: int):
+        """Runs the searches of the block on the collection with the given search_ef."""
+        with self.condition:
+            state = self.states.setdefault(collection.id, {"ef": None, "running": 0, "waiting": deque()})
+            if state["waiting"] or (state["running"] and state["ef"] != ef):
+                ticket = [ef, False]
+                state["waiting"].append(ticket)
+                while not ticket[1]:
+                    self.condition.wait()
+            else:
+                self.admit(collection, state, ef, 1)
+        try:
+            yield
+        finally:
+            with self.condition:
+                state["running"] -= 1
+                if not state["running"] and state["waiting"]:
+                    # The oldest queued ef is next, with every queued search using it
+                    ef = state["waiting"][0][0]
+                    admitted = [ticket for ticket in state["waiting"] if ticket[0] == ef]
+                    state["waiting"] = deque(ticket for ticket in state["waiting"] if ticket[0] != ef)
+                    self.admit(collection, state, ef, len(admitted))
+                    for ticket in admitted:
+                        ticket[1] = True
+                    self.condition.notify_all()
+
+    @staticmethod
+    def admit(collection, state: dict, ef: int, searches: int):
+        if not state["running"]:
+            index = hnsw_index(collection)
+            if index is not None:
+                index.set_ef(ef)
+            state["ef"] = ef
+        state["running"] += searches
+
+    def save(self, space_id: Optional[int], params: dict):
+        spaces = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                spaces = json.load(f).get("spaces", {})
+        spaces[str(space_id)] = params
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump({"spaces": spaces}, f, indent=2)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+search_params = SearchParams(
+    os.path.join(settings.VECTORDB_PERSIST_DIR, "search_params.json"),
+    settings.COLLECTION_METADATA["hnsw:search_ef"],
+)
+
+
+def stored_vectors(space_id: Optional[int], limit: int) -> np.ndarray:
+    from app.partitions import partitions
+
+    results = partitions.collection(space_id).get(
+        where=partitions.where(space_id), include=["embeddings"], limit=limit
+    )
+    return np.asarray(results["embeddings"], dtype=np.float32)
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Exact k nearest rows of vectors by cosine distance, for every query."""
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ vectors.T), axis=1, kind="stable")[:, :k]
+
+
+def sweep(vectors: np.ndarray, queries: np.ndarray, k: int, m_values: List[int], ef_values: List[int]) -> List[dict]:
+    """Indexes the vectors once per M in a temporary Chroma directory and measures every ef.
+    Returns:
+        list[dict]: M, search_ef, recall@k, p50_ms and p99_ms of every combination.
+    """
+    import chromadb
+    from chromadb.config import Settings as ChromaSettings
+
+    expected = ground_truth(vectors, queries, k)
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+        for m in m_values:
+            collection = client.create_collection(
+                f"tune-m{m}", embedding_function=None,
+                metadata={**settings.COLLECTION_METADATA, "hnsw:M": m},
+            )
+            for start in range(0, len(vectors), settings.CHROMA_BATCH_SIZE):
+                rows = vectors[start:start + settings.CHROMA_BATCH_SIZE]
+                collection.add(ids=[str(start + i) for i in range(len(rows))], embeddings=rows)
+            tuner = SearchParams(os.path.join(path, "unused.json"), settings.COLLECTION_METADATA["hnsw:search_ef"])
+            for ef in ef_values:
+                latencies, recalls = [], []
+                with tuner.applied(collection, ef):
+                    for query, exact in zip(queries, expected):
+                        start = time.perf_counter()
+                        found = collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+                        latencies.append(time.perf_counter() - start)
+                        recalls.append(len({int(i) for i in found} & set(exact.tolist())) / k)
+                latencies = np.array(latencies) * 1000
+                results.append({
+                    "M": m,
+                    "search_ef": ef,
+                    "recall": float(np.mean(recalls)),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                })
+                logger.info(f"M={m} ef={ef}: recall@{k} {results[-1]['recall']:.3f}, p50 {results[-1]['p50_ms']:.2f} ms")
+            client.delete_collection(collection.name)
+    return results
+
+
+def recommend(results: List[dict], target_recall: float) -> dict:
+    """The fastest (p50) combination reaching the target recall, the most accurate one if none does."""
+    reaching = [result for result in results if result["recall"] >= target_recall]
+    if reaching:
+        return min(reaching, key=lambda result: (result["p50_ms"], result["search_ef"]))
+    return max(results, key=lambda result: (result["recall"], -result["p50_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the HNSW parameters of a space against an exact search.")
+    parser.add_argument("--tune", action="store_true", help="sweep M and search_ef and save the recommendation")
+    parser.add_argument("--space-id", type=int, nargs="+", default=[None], help="spaces to tune, the whole collection if omitted")
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--queries", type=int, default=200, help="stored vectors held out as queries")
+    parser.add_argument("--sample", type=int, default=50000, help="maximum number of stored vectors indexed")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef", type=int, nargs="+", default=[10, 20, 40, 80, 160, 320])
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    args = parser.parse_args()
+
+    if not args.tune:
+        search_params.tuned(None)
+        print(json.dumps({"default_search_ef": search_params.default_ef, "spaces": search_params.spaces}, indent=2))
+        return
+    rng = np.random.default_rng(0)
+    for space_id in args.space_id:
+        vectors = stored_vectors(space_id, args.sample + args.queries)
+        if len(vectors) <= args.queries:
+            print(f"Space {space_id}: {len(vectors)} vectors, not enough to hold out {args.queries} queries")
+            continue
+        order = rng.permutation(len(vectors))
+        queries, vectors = vectors[order[:args.queries]], vectors[order[args.queries:]]
+        results = sweep(vectors, queries, args.k, args.m, args.ef)
+
+        print(f"Space {space_id}: {len(vectors)} vectors, {len(queries)} queries")
+        print(f"{'M':>4} {'ef':>5} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for result in results:
+            print(f"{result['M']:>4} {result['search_ef']:>5} {result['recall']:>10.3f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+        best = recommend(results, args.target_recall)
+        # Existing indexes keep the M they were built with, their search_ef is tuned for that M
+        current_m = settings.COLLECTION_METADATA["hnsw:M"]
+        current = [result for result in results if result["M"] == current_m]
+        applied = recommend(current, args.target_recall) if current else best
+        search_params.save(space_id, {**applied, "k": args.k, "vectors": len(vectors), "recommended": best})
+        print(f"search_ef={applied['search_ef']} for M={applied['M']} (recall@{args.k} {applied['recall']:.3f}), saved to {search_params.path}")
+        if best["M"] != applied["M"]:
+            print(
+                f"Recommended M={best['M']} search_ef={best['search_ef']} (recall@{args.k} {best['recall']:.3f}), "
+                "M only applies to new collections: set hnsw:M in COLLECTION_METADATA and migrate to use it"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+from app.core.metrics import LatencyStats
+from app.query_relation_db import RelationDB
+from app.rag import RAG
+
+
+class ToolRegistry:
+    """Pipelines behind the agent tools, built on first use and shared by every request of the process.
+
+    Compiled LangGraph graphs and ChatOpenAI clients hold no per-call state, so one instance of
+    each pipeline serves concurrent requests and keeps its HTTP connections warm. The first call
+    of a tool, which builds its pipeline, is reported apart from the warm ones. The agent also
+    records every tool call it runs, with its outcome.
+    """
+
+    def __init__(self):
+        self.builders: Dict[str, Callable] = {}
+        self.pipelines = {}
+        self.build_seconds = {}
+        self.cold_seconds = {}  # name -> latency of the call that built the pipeline
+        self.warm = {}  # name -> LatencyStats of the calls served by the built pipeline
+        self.calls = {}  # tool name -> LatencyStats of the agent's calls
+        self.outcomes = {}  # tool name -> {outcome: count}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable):
+        self.builders[name] = builder
+
+    def get(self, name: str):
+        """The shared pipeline of a tool, built by the first caller, the others wait for it."""
+        pipeline = self.pipelines.get(name)
+        if pipeline is None:
+            with self.lock:
+                if name not in self.pipelines:
+                    start = time.perf_counter()
+                    self.pipelines[name] = self.builders[name]()
+                    self.build_seconds[name] = time.perf_counter() - start
+                    logger.info(f"Built the {name} pipeline in {self.build_seconds[name]:.3f} s")
+                pipeline = self.pipelines[name]
+        return pipeline
+
+    @contextmanager
+    def call(self, name: str):
+        """Yields the pipeline of a tool and records the latency of the block."""
+        cold = name not in self.pipelines
+        start = time.perf_counter()
+        try:
+            yield self.get(name)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                if cold and name not in self.cold_seconds:
+                    self.cold_seconds[name] = elapsed
+                else:
+                    self.warm.setdefault(name, LatencyStats()).add(elapsed)
+
+    def record(self, tool: str, outcome: str, seconds: Optional[float] = None):
+        """Records an agent tool call, outcome is ok, error or timeout.
+
+        The agent stops waiting for calls that time out, their latency is recorded when they finish.
+        """
+        with self.lock:
+            if seconds is not None:
+                self.calls.setdefault(tool, LatencyStats()).add(seconds)
+            outcomes = self.outcomes.setdefault(tool, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            names = list(self.pipelines)
+            warm = dict(self.warm)
+            calls = dict(self.calls)
+            outcomes = {tool: dict(counts) for tool, counts in self.outcomes.items()}
+        return {
+            "pipelines": {
+                name: {
+                    "build_ms": self.build_seconds[name] * 1000,
+                    "cold_call_ms": self.cold_seconds[name] * 1000 if name in self.cold_seconds else None,
+                    "warm": warm[name].stats() if name in warm else {"count": 0},
+                }
+                for name in names
+            },
+            "tools": {
+                tool: {**(calls[tool].stats() if tool in calls else {"count": 0}), **counts}
+                for tool, counts in outcomes.items()
+            },
+        }
+
+
+tool_registry = ToolRegistry()
+tool_registry.register("rag", RAG)
+tool_registry.register("sql", RelationDB)
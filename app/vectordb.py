@@ -1,79 +1,390 @@
 import os
+import time
+import numpy as np
 from typing_extensions import Annotated, TypedDict
 from loguru import logger
 
-from langchain_core.prompts import PromptTemplate, FewShotPromptTemplate
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_chroma import Chroma
+from app.cache import cache_key
+from app.chunk_store import chunk_store, filter_metadata
 from app.core.config import settings
+from app.embedding_writer import EmbeddingWriter
+from app.embeddings import embeddings
+from app.exact_search import exact_index, sample_recall, search_stats
+from app.lexical_index import lexical_index
+from app.matryoshka import full_vectors, truncate
+from app.partitions import partitions
+from app.search_params import search_params
+from app.pipeline import iter_pages, iter_chunks, iter_windows, batched, prefetch
+from typing import List
 from uuid import uuid4
 
 from langchain_core.documents import Document
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+class VectorDB:
+    def __init__(self):
+        self.embeddings = embeddings
+        self.partitions = partitions
+        self.writer = EmbeddingWriter(self.embeddings, self.partitions)
 
-def load_docs(file_path) -> list[Document]:
-    loader = PyPDFLoader(file_path)
-
-    raw_documents = loader.load()
+    def prepare(self, batches, progress=None):
+        """Turns batches of (window, chunk) pairs into the documents to embed."""
+        for batch in batches:
+            yield [doc for _, doc in batch]
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1024,
-        chunk_overlap=20,
-        length_function=len,
-        separators=["\n\n", "\n", " "],
-    )
-    docs = text_splitter.split_documents(raw_documents)
+    @staticmethod
+    def assign_ids(pairs, space_id: int, document_id: int, existing: dict, records: list):
+        """Hashes the chunks and gives them ids, reusing the stored chunk with the same hash if any.
 
-    return docs
-
-class VectorDB:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self.vector_store = Chroma(
-            collection_name=settings.COLLECTION_NAME,
-            embedding_function=self.embeddings,
-            persist_directory=settings.VECTORDB_PERSIST_DIR,
-            collection_metadata=settings.COLLECTION_METADATA
-        )
+        Only the chunks without a stored copy are passed on to be embedded.
+        """
+        available = {content_hash: list(ids) for content_hash, ids in existing.items()}
+        for window, doc in pairs:
+            content_hash = cache_key(doc.page_content)
+            if available.get(content_hash):
+                records.append((available[content_hash].pop(), content_hash))
+                continue
+            doc.id = str(uuid4())
+            doc.metadata["space_id"] = space_id
+            doc.metadata["document_id"] = document_id
+            doc.metadata["content_hash"] = content_hash
+            records.append((doc.id, content_hash))
+            yield window, doc
 
     @settings.timeit
-    def embed_docs(self, file_path, space_id:int, document_id:int):
+    def embed_docs(self, file_path, space_id:int, document_id:int, progress=None, existing=None):
+        """Streams the PDF through page -> chunk -> prepare -> embed -> write in fixed-size batches.
+
+        Every stage is connected by a bounded queue, so memory does not grow with the PDF
+        and the first batches are searchable before the last page is parsed.
+        Args:
+            existing: content hash -> chunk ids already stored for the document, those chunks are not embedded again.
+        Returns:
+            list[tuple[str, str]]: (chunk_id, content_hash) of every chunk of the file, in order.
+        """
         try:
-            docs = load_docs(file_path)
-            uuids = [str(uuid4()) for _ in range(len(docs))]
-            for doc in docs:
-                doc.metadata["space_id"] = space_id
-                doc.metadata["document_id"] = document_id
-            self.vector_store.add_documents(documents=docs, ids=uuids)
-            return uuids
+            records = []
+            chunks = iter_windows(iter_chunks(iter_pages(file_path, progress)))
+            chunks = self.assign_ids(chunks, space_id, document_id, existing or {}, records)
+            self.write(chunks, progress)
+            return records
         except Exception as e:
             logger.error(e)
+            raise
+
+    def write(self, chunks, progress=None):
+        """Runs (window, chunk) pairs through prepare -> index -> embed -> write in bounded INGESTION_BATCH_SIZE batches."""
+        batches = batched(prefetch(chunks, settings.INGESTION_QUEUE_SIZE), settings.INGESTION_BATCH_SIZE)
+        return self.writer.write(prefetch(self.index(self.prepare(batches, progress)), 1), progress)
+
+    @staticmethod
+    def index(batches):
+        """Adds the prepared documents to the BM25 index on their way to the embedder."""
+        for docs in batches:
+            lexical_index.add_documents(docs)
+            yield docs
 
     @settings.timeit
-    def retrieve(self, question: str, score_thr=2, k=15, space_id=None):
-        try:
-            if space_id:
-                retrieved_docs = self.vector_store.similarity_search_with_score(
-                    question,
-                    k=k,
-                    filter={"space_id": space_id}
-                )
-            else:
-                retrieved_docs = self.vector_store.similarity_search_with_score(
-                    question,
-                    k=k
+    def copy_document(self, source_document_id: int, space_id: int, document_id: int, progress=None,
+                      source_space_id=None):
+        """Links the stored chunk vectors of an already ingested document to a new document.
+
+        Vectors, texts and metadata are copied under new ids, nothing is parsed or embedded again.
+        Args:
+            source_space_id: space of the source document, when it differs from space_id.
+        Returns:
+            list[tuple[str, str]]: (chunk_id, content_hash) of the new chunks, empty if the source document has no vectors.
+        """
+        source = self.partitions.collection(source_space_id or space_id)
+        collection = self.partitions.collection(space_id)
+        records = []
+        offset = 0
+        while True:
+            results = source.get(
+                where={"document_id": source_document_id},
+                include=["embeddings", "documents", "metadatas"],
+                limit=settings.INGESTION_BATCH_SIZE,
+                offset=offset,
+            )
+            if not results["ids"]:
+                break
+            offset += len(results["ids"])
+
+            # Chunks written before the chunk store existed keep their text in Chroma
+            stored = chunk_store.get(results["ids"])
+            chunks = [
+                stored.get(chunk_id) or (text, metadata)
+                for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+            ]
+            docs = [
+                Document(
+                    page_content=text,
+                    metadata={
+                        **metadata,
+                        "space_id": space_id,
+                        "document_id": document_id,
+                        "content_hash": self.content_hash(metadata, text),
+                    },
+                    id=str(uuid4()),
                 )
+                for text, metadata in chunks
+            ]
+            ids = [doc.id for doc in docs]
+            chunk_store.add(docs)
+            collection.upsert(
+                ids=ids,
+                embeddings=results["embeddings"],
+                metadatas=[filter_metadata(doc.metadata) for doc in docs],
+            )
+            lexical_index.add_documents(docs)
+            stored_count = lambda: self.partitions.count(space_id)
+            vectors = results["embeddings"]
+            if full_vectors:
+                full = full_vectors.get(source_space_id or space_id, results["ids"])
+                if len(full) == len(ids):
+                    vectors = [full[chunk_id] for chunk_id in results["ids"]]
+                    full_vectors.add(space_id, ids, vectors, stored_count)
+                else:
+                    full_vectors.untrack(space_id, "copied chunks have no full vectors")
+            exact_index.add(space_id, ids, vectors, stored_count)
+            records.extend((doc.id, doc.metadata["content_hash"]) for doc in docs)
+            if progress:
+                progress("vectors_written", len(ids))
+        return records
+
+    @staticmethod
+    def content_hash(metadata: dict, text: str) -> str:
+        # Chunks stored before content hashes were recorded are hashed from their original text
+        return metadata.get("content_hash") or cache_key(metadata.get("origin_content") or text)
+
+    def stored_chunks(self, space_id: int, document_id: int) -> dict:
+        """Groups the stored chunk ids of a document by content hash, read from the vector store.
+        Returns:
+            dict: content hash -> chunk ids.
+        """
+        results = self.partitions.collection(space_id).get(where={"document_id": document_id}, include=[])
+        chunk_ids = {}
+        for chunk_id, (text, metadata) in self.load_chunks(space_id, results["ids"]).items():
+            chunk_ids.setdefault(self.content_hash(metadata, text), []).append(chunk_id)
+        return chunk_ids
+
+    def delete_chunks(self, space_id: int, chunk_ids: list) -> None:
+        """Deletes vectors of a space by id, in CHROMA_BATCH_SIZE batches."""
+        collection = self.partitions.collection(space_id)
+        for ids in batched(chunk_ids, settings.CHROMA_BATCH_SIZE):
+            collection.delete(ids=ids)
+            lexical_index.delete(ids)
+            chunk_store.delete(ids)
+        exact_index.delete(space_id, chunk_ids)
+        if full_vectors:
+            full_vectors.delete(space_id, chunk_ids)
+
+    def delete_document(self, space_id: int, document_id: int, keep=()) -> None:
+        """Deletes every vector of a document except the ids in keep."""
+        lexical_index.delete_document(document_id, keep)
+        collection = self.partitions.collection(space_id)
+        results = collection.get(where={"document_id": document_id}, include=[])
+        if not keep:
+            collection.delete(where={"document_id": document_id})
+            chunk_store.delete(results["ids"])
+            exact_index.delete(space_id, results["ids"])
+            if full_vectors:
+                full_vectors.delete(space_id, results["ids"])
+            return
+        keep = set(keep)
+        self.delete_chunks(space_id, [chunk_id for chunk_id in results["ids"] if chunk_id not in keep])
 
-            docs = []
-            for doc, score in retrieved_docs:
-                if score <= score_thr:
-                    docs.append(doc)
+    def get_chunks(self, space_id: int, chunk_ids: List[str], include=("embeddings",)) -> dict:
+        """Reads stored vectors of a space by id, in Chroma's get result format. Texts are read with load_chunks."""
+        return self.partitions.collection(space_id).get(ids=chunk_ids, include=list(include))
+
+    def load_chunks(self, space_id: int, chunk_ids: List[str]) -> dict:
+        """Text and metadata of chunks of a space by id, missing chunks are left out.
+        Returns:
+            dict: chunk id -> (text, metadata), from the chunk store, or from Chroma for chunks
+            written before it existed.
+        """
+        chunks = chunk_store.get(chunk_ids)
+        missing = [chunk_id for chunk_id in dict.fromkeys(chunk_ids) if chunk_id not in chunks]
+        if missing:
+            stored = self.get_chunks(space_id, missing, include=["documents", "metadatas"])
+            chunks.update(
+                (chunk_id, (text, metadata or {}))
+                for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+                if text is not None
+            )
+        return chunks
+
+    def query(self, vectors, k: int, space_id=None, search_ef=None) -> List[list]:
+        """Nearest chunks of every vector as (chunk_id, text, metadata, distance), nearest first.
+
+        Texts are None and metadata only holds the filter fields, see hydrate. Spaces tracked by
+        the exact index (up to EXACT_SEARCH_MAX_VECTORS vectors) are searched by brute force over
+        their memory-mapped matrix, or its quantized codes with VECTOR_QUANTIZATION, larger ones
+        by HNSW. A sample of the searches is repeated with the other strategies to measure their recall.
+        Args:
+            search_ef: HNSW search_ef of this query, by default the one tuned for the space.
+        """
+        if space_id:
+            start = time.perf_counter()
+            found = exact_index.search(space_id, vectors, k)
+            if found is not None:
+                strategy, results = found
+                hits = [
+                    [(chunk_id, None, {"space_id": space_id}, distance) for chunk_id, distance in nearest]
+                    for nearest in results
+                ]
+                search_stats.add(strategy, time.perf_counter() - start)
+                if sample_recall():
+                    expected = results if strategy == "exact" else exact_index.search(space_id, vectors, k, full=True)[1]
+                    self.sample_recall(expected, {
+                        strategy: results,
+                        "hnsw": self.search_hnsw(vectors, k, space_id, search_ef),
+                    })
+                return hits
+        start = time.perf_counter()
+        hits = self.search_hnsw(vectors, k, space_id, search_ef)
+        search_stats.add("hnsw", time.perf_counter() - start)
+        return hits
+
+    @staticmethod
+    def sample_recall(expected: List[list], strategies: dict):
+        """Records the recall@k of the results of every strategy against the exact results."""
+        for i, hits in enumerate(expected):
+            if not hits:
+                continue
+            exact = {hit[0] for hit in hits}
+            for strategy, results in strategies.items():
+                search_stats.add_recall(strategy, len(exact & {hit[0] for hit in results[i]}) / len(exact))
+
+    def hydrate(self, docs: List[Document]) -> List[Document]:
+        """Reads the text and metadata of the search results that only carry their id and filter fields.
+
+        Documents are filled in place, the ones of chunks that no longer exist are left out.
+        """
+        start = time.perf_counter()
+        pending = {}
+        for doc in docs:
+            if not doc.page_content:
+                pending.setdefault(doc.metadata.get("space_id"), []).append(doc.id)
+        if not pending:
             return docs
+        chunks = {}
+        for space_id, chunk_ids in pending.items():
+            chunks.update(self.load_chunks(space_id, chunk_ids))
+        for doc in docs:
+            if not doc.page_content and doc.id in chunks:
+                doc.page_content, metadata = chunks[doc.id]
+                doc.metadata = dict(metadata)
+        search_stats.add("hydrate", time.perf_counter() - start)
+        return [doc for doc in docs if doc.page_content]
+
+    def search_hnsw(self, vectors, k: int, space_id=None, search_ef=None) -> List[list]:
+        """HNSW search of the space's collection. Without a space, every partition is searched and the results are merged.
+
+        With ANN_DIMENSIONS, k * ANN_RESCORE candidates are searched with the truncated vectors
+        and rescored with the full vectors.
+        """
+        if space_id or not self.partitions.partitioned:
+            collections = [self.partitions.collection(space_id or None)]
+        else:
+            collections = list(self.partitions.all())
+        ef = search_params.search_ef(space_id or None, search_ef)
+        n_results = k * settings.ANN_RESCORE if full_vectors else k
+        hits = [[] for _ in vectors]
+        for collection in collections:
+            with search_params.applied(collection, ef):
+                results = collection.query(
+                    query_embeddings=list(truncate(vectors, settings.ANN_DIMENSIONS)),
+                    n_results=n_results,
+                    where=self.partitions.where(space_id or None),
+                    include=["metadatas", "distances"],
+                )
+            for found, row in zip(hits, zip(results["ids"], results["metadatas"], results["distances"])):
+                found.extend((chunk_id, None, metadata, distance) for chunk_id, metadata, distance in zip(*row))
+        if full_vectors:
+            return [self.rescore(vector, found, k) for vector, found in zip(vectors, hits)]
+        if len(collections) == 1:
+            return hits
+        return [sorted(found, key=lambda hit: hit[3])[:k] for found in hits]
+
+    @staticmethod
+    def rescore(vector, hits: List[tuple], k: int) -> List[tuple]:
+        """Replaces the distances of the hits by the ones of the full vectors and keeps the best k.
+
+        Hits without a full vector keep their distance in the truncated space.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        by_space = {}
+        for hit in hits:
+            by_space.setdefault((hit[2] or {}).get("space_id"), []).append(hit[0])
+        full = {}
+        for space_id, chunk_ids in by_space.items():
+            if space_id is not None:
+                full.update(full_vectors.get(space_id, chunk_ids))
+        rescored = [
+            (*hit[:3], float(1.0 - full[hit[0]] @ query) if hit[0] in full else hit[3])
+            for hit in hits
+        ]
+        return sorted(rescored, key=lambda hit: hit[3])[:k]
+
+    @settings.timeit
+    def retrieve(self, question: str, score_thr=2, k=15, space_id=None, search_ef=None, hydrate=True):
+        try:
+            return self.retrieve_many(
+                [question], score_thr=score_thr, k=k, space_id=space_id, search_ef=search_ef, hydrate=hydrate
+            )[0]
         except Exception as e:
             logger.error(e)
 
+    @settings.timeit
+    def retrieve_many(self, questions: List[str], score_thr=2, k=15, space_id=None, hybrid=None,
+                      search_ef=None, hydrate=True) -> List[List[Document]]:
+        """Retrieves the chunks of many questions with one embedding request and one Chroma query.
+
+        With hybrid search (HYBRID_SEARCH) and a space, the dense results are fused with the BM25
+        results of the space by reciprocal rank fusion.
+        Args:
+            questions: questions, already embedded ones are served from the query embedding cache.
+            search_ef: HNSW search_ef of these queries, by default the one tuned for the space.
+            hydrate: read the texts of the chunks. Without, Documents only carry their id and
+                filter fields until passed to hydrate, e.g. by the reranker for the chunks it keeps.
+        Returns:
+            list[list[Document]]: the best k chunks of each question, in the order of the questions.
+        """
+        if not questions:
+            return []
+        vectors = self.embeddings.embed_query_vectors(questions)
+        dense = [
+            [
+                Document(page_content=text or "", metadata=metadata or {}, id=chunk_id)
+                for chunk_id, text, metadata, score in hits
+                if score <= score_thr
+            ]
+            for hits in self.query(vectors, k, space_id, search_ef)
+        ]
+        if (settings.HYBRID_SEARCH if hybrid is None else hybrid) and space_id:
+            lexical = [[chunk_id for chunk_id, _ in lexical_index.search(space_id, question, k)] for question in questions]
+            fetched = {
+                chunk_id: Document(page_content="", metadata={"space_id": space_id}, id=chunk_id)
+                for ids in lexical for chunk_id in ids
+            }
+            dense = [self.fuse(docs, ids, fetched, k) for docs, ids in zip(dense, lexical)]
+        if not hydrate:
+            return dense
+        self.hydrate([doc for docs in dense for doc in docs])
+        return [[doc for doc in docs if doc.page_content] for docs in dense]
+
+    @staticmethod
+    def fuse(dense: List[Document], lexical: List[str], fetched: dict, k: int) -> List[Document]:
+        """Reciprocal rank fusion: every list adds 1 / (RRF_K + rank) to the score of its chunks."""
+        docs = {doc.id: doc for doc in dense}
+        scores = {}
+        for ranking in ([doc.id for doc in dense], lexical):
+            for rank, chunk_id in enumerate(ranking, 1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (settings.RRF_K + rank)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [docs.get(chunk_id) or fetched[chunk_id] for chunk_id in ranked if chunk_id in docs or chunk_id in fetched][:k]
 
 vectordb = VectorDB()
@@ -0,0 +1,109 @@
+"""Soak test of the conversation checkpointers: memory and turn latency over many threads.
+
+    python -m benchmarks.checkpointer [--threads 100000] [--turns 2] [--checkpointers memory bounded] [--checkpoint-ttl 60]
+
+A graph with the agent's state and a node answering without any model call is invoked for
+`turns` turns on every thread_id, like POST /chatbot/chat. Each checkpointer runs in its own
+process: memory is the previous in-process MemorySaver, bounded the SQLite BoundedCheckpointer
+with CHECKPOINT_CACHE_THREADS / CHECKPOINT_CACHE_TTL / CHECKPOINT_KEEP / CHECKPOINT_TTL (or
+--checkpoint-ttl), writing to a temporary file. Reported every tenth of the threads: resident
+memory, size of the SQLite file and p50/p99 latency of the turns.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+QUESTION = "Question: {}\nAdditional Information (optional): user_id: 1; space_id: 1"
+ANSWER = "The latest document uploaded in the space is the quarterly report. " * 8
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def build_graph(checkpointer):
+    from langchain_core.messages import AIMessage
+    from langgraph.graph import StateGraph
+
+    from app.agent import AgentState
+
+    def answer(state: AgentState):
+        return {"messages": [AIMessage(content=ANSWER)]}
+
+    graph = StateGraph(AgentState)
+    graph.add_node("llm", answer)
+    graph.set_entry_point("llm")
+    graph.set_finish_point("llm")
+    return graph.compile(checkpointer=checkpointer)
+
+
+def disk_mb(path: str) -> float:
+    return sum(os.path.getsize(file) for file in (path, f"{path}-wal") if os.path.exists(file)) / 1e6
+
+
+def soak(name: str, threads: int, turns: int, path: str, checkpoint_ttl, results):
+    if name == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+
+        checkpointer = MemorySaver()
+    else:
+        from app.checkpointer import create_checkpointer
+        from app.core.config import settings
+
+        if checkpoint_ttl is not None:
+            settings.CHECKPOINT_TTL = checkpoint_ttl
+        checkpointer = create_checkpointer(path)
+    graph = build_graph(checkpointer)
+    rows = []
+    latencies = []
+    for thread in range(threads):
+        config = {"configurable": {"thread_id": f"thread-{thread}"}}
+        for turn in range(turns):
+            start = time.perf_counter()
+            graph.invoke({"messages": [{"role": "human", "content": QUESTION.format(turn)}]}, config)
+            latencies.append(time.perf_counter() - start)
+        if (thread + 1) % max(1, threads // 10) == 0:
+            window = np.array(latencies) * 1000
+            rows.append((
+                thread + 1, rss_mb(), disk_mb(path), float(np.percentile(window, 50)), float(np.percentile(window, 99))
+            ))
+            latencies = []
+    stats = checkpointer.stats() if hasattr(checkpointer, "stats") else {}
+    results.put((name, rows, stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the conversation checkpointers.")
+    parser.add_argument("--threads", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=2)
+    parser.add_argument("--checkpointers", nargs="+", default=["memory", "bounded"])
+    parser.add_argument("--checkpoint-ttl", type=int, help="seconds before an idle thread is deleted, CHECKPOINT_TTL by default")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as path:
+        for name in args.checkpointers:
+            process = context.Process(
+                target=soak,
+                args=(name, args.threads, args.turns, os.path.join(path, f"{name}.sqlite3"), args.checkpoint_ttl, results)
+            )
+            process.start()
+            name, rows, stats = results.get()
+            process.join()
+            print(f"{name}: {args.threads} threads x {args.turns} turns" + (f", {stats}" if stats else ""))
+            print(f"{'threads':>9} {'RSS MB':>8} {'disk MB':>8} {'p50 ms':>8} {'p99 ms':>8}")
+            for threads, rss, disk, p50, p99 in rows:
+                print(f"{threads:>9} {rss:>8.1f} {disk:>8.1f} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compares the Chroma size and query time of chunk texts stored in Chroma with the chunk store.
+
+    python -m benchmarks.chunk_store [--chunks 10000] [--dim 1536] [--queries 200] [--k 15] [--keep 5]
+
+Synthetic contextualized chunks (CHUNK_SIZE characters of text, a context of a few sentences)
+are written to a temporary directory twice:
+    - chroma: the previous layout, the chunk plus its context as Chroma document, and the
+      origin_content/contextualized_content copies in its metadata
+    - compact: the vectors and filter fields in Chroma, text and metadata in the chunk store
+Reported per layout: the size of the Chroma files and of the chunk store per chunk, their total
+per million chunks, and the latency of a query of k chunks: returning the texts for the chroma
+layout, reading the texts of the `keep` chunks kept by the reranker, or of all k, from the chunk
+store for the compact one. "+p50 ms" is the time spent on top of a query returning ids only.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings as ChromaSettings
+from langchain_core.documents import Document
+
+from app.chunk_store import ChunkStore, chroma_size, filter_metadata
+from app.core.config import settings
+from app.pipeline import batched
+
+CHUNK_SIZE = 1024
+CONTEXT_SIZE = 400
+
+
+def words(rng, vocabulary, size: int) -> str:
+    text = " ".join(vocabulary[rng.integers(len(vocabulary), size=size // 6)])
+    return text[:size]
+
+
+def synthetic(count: int, dim: int, rng):
+    vocabulary = np.array(["".join(chr(97 + c) for c in rng.integers(26, size=rng.integers(2, 10))) for _ in range(5000)])
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    docs = []
+    for i in range(count):
+        text, context = words(rng, vocabulary, CHUNK_SIZE), words(rng, vocabulary, CONTEXT_SIZE)
+        docs.append(Document(
+            page_content=f"{text}\n\n{context}",
+            metadata={
+                "source": f"/mnt/data/pdf/document-{i // 200}.pdf",
+                "page": i % 200 // 4,
+                "space_id": 1,
+                "document_id": i // 200,
+                "content_hash": f"{i:064x}",
+                "origin_content": text,
+                "contextualized_content": context,
+            },
+            id=str(i),
+        ))
+    return vectors, docs
+
+
+def measure(search, queries: np.ndarray) -> dict:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunk texts in Chroma against the chunk store.")
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--keep", type=int, default=5, help="chunks kept by the reranker")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors, docs = synthetic(args.chunks, args.dim, rng)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    sizes, results = {}, {}
+    with tempfile.TemporaryDirectory() as path:
+        collections = {}
+        store = ChunkStore(os.path.join(path, "chunks.sqlite3"))
+        for layout in ("chroma", "compact"):
+            os.makedirs(os.path.join(path, layout))
+            client = chromadb.PersistentClient(path=os.path.join(path, layout), settings=ChromaSettings(anonymized_telemetry=False))
+            collection = client.create_collection("benchmark", embedding_function=None, metadata=settings.COLLECTION_METADATA)
+            for rows in batched(list(zip(docs, vectors)), settings.CHROMA_BATCH_SIZE):
+                batch = [doc for doc, _ in rows]
+                ids = [doc.id for doc in batch]
+                embeddings = [vector for _, vector in rows]
+                if layout == "chroma":
+                    collection.add(
+                        ids=ids, embeddings=embeddings,
+                        documents=[doc.page_content for doc in batch], metadatas=[doc.metadata for doc in batch],
+                    )
+                else:
+                    store.add(batch)
+                    collection.add(ids=ids, embeddings=embeddings, metadatas=[filter_metadata(doc.metadata) for doc in batch])
+            collections[layout] = collection
+            sizes[layout] = [chroma_size(os.path.join(path, layout)), 0]
+        sizes["compact"][1] = sum(
+            os.path.getsize(file) for file in (store.path, f"{store.path}-wal") if os.path.exists(file)
+        )
+
+        def ids_only(query):
+            return collections["compact"].query(query_embeddings=[query], n_results=args.k, include=["distances"])
+
+        def chroma(query):
+            return collections["chroma"].query(
+                query_embeddings=[query], n_results=args.k, include=["documents", "metadatas", "distances"]
+            )
+
+        def compact(query, hydrated):
+            found = collections["compact"].query(query_embeddings=[query], n_results=args.k, include=["metadatas", "distances"])
+            return store.get(found["ids"][0][:hydrated])
+
+        # Loads both indexes outside of the measured time
+        ids_only(queries[0]), chroma(queries[0])
+        results["ids only"] = measure(ids_only, queries)
+        results["chroma"] = measure(chroma, queries)
+        results[f"compact, {args.keep} texts"] = measure(lambda query: compact(query, args.keep), queries)
+        results[f"compact, {args.k} texts"] = measure(lambda query: compact(query, args.k), queries)
+
+    print(f"{args.chunks} chunks of {CHUNK_SIZE} + {CONTEXT_SIZE} characters, {args.dim} dimensions, k={args.k}")
+    print(f"{'layout':<8} {'Chroma B/chunk':>14} {'store B/chunk':>13} {'GB per 1M':>10}")
+    for layout, (chroma_bytes, store_bytes) in sizes.items():
+        total = (chroma_bytes + store_bytes) / args.chunks
+        print(f"{layout:<8} {chroma_bytes / args.chunks:>14.0f} {store_bytes / args.chunks:>13.0f} {total * 1e6 / 1e9:>10.2f}")
+    baseline = results["ids only"]["p50_ms"]
+    print(f"{'query':<20} {'p50 ms':>8} {'p95 ms':>8} {'+p50 ms':>8}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p50_ms'] - baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
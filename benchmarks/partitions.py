@@ -0,0 +1,94 @@
+"""Compares filtered searches of one global collection with searches of per-space collections.
+
+    python -m benchmarks.partitions [--spaces 10 100] [--vectors 500] [--dim 256] [--queries 50]
+
+Random unit vectors are written to a temporary Chroma directory twice: once in a single
+collection searched with a space_id filter (VECTORDB_PARTITION=none), once in one collection
+per space (VECTORDB_PARTITION=space). Both use COLLECTION_METADATA, and the queries of every
+space are answered by both layouts. Reported per number of spaces: latency percentiles and
+recall@k against an exact search of the space's vectors.
+"""
+import argparse
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings as ChromaSettings
+
+from app.core.config import settings
+from app.pipeline import batched
+
+
+def populate(client, spaces: int, vectors: np.ndarray):
+    """Writes vectors[space] of every space to both layouts."""
+    global_collection = client.create_collection("global", metadata=settings.COLLECTION_METADATA)
+    for space_id in range(spaces):
+        ids = [f"{space_id}-{i}" for i in range(len(vectors[space_id]))]
+        metadatas = [{"space_id": space_id} for _ in ids]
+        space_collection = client.create_collection(f"space-{space_id}", metadata=settings.COLLECTION_METADATA)
+        for rows in batched(list(zip(ids, vectors[space_id].tolist(), metadatas)), settings.CHROMA_BATCH_SIZE):
+            batch_ids, embeddings, batch_metadatas = (list(column) for column in zip(*rows))
+            global_collection.add(ids=batch_ids, embeddings=embeddings, metadatas=batch_metadatas)
+            space_collection.add(ids=batch_ids, embeddings=embeddings, metadatas=batch_metadatas)
+
+
+def search(collection, query: np.ndarray, k: int, where=None):
+    start = time.perf_counter()
+    results = collection.query(query_embeddings=[query.tolist()], n_results=k, where=where, include=[])
+    return results["ids"][0], time.perf_counter() - start
+
+
+def summarize(latencies, recalls) -> dict:
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "recall": float(np.mean(recalls)),
+    }
+
+
+def run(spaces: int, per_space: int, dim: int, queries: int, k: int, rng) -> dict:
+    vectors = rng.standard_normal((spaces, per_space, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+        populate(client, spaces, vectors)
+        global_collection = client.get_collection("global")
+        timings = {"global": ([], []), "space": ([], [])}
+        for _ in range(queries):
+            space_id = int(rng.integers(spaces))
+            query = rng.standard_normal(dim).astype(np.float32)
+            # Cosine distance, the exact neighbors are the largest dot products with unit vectors
+            exact = {f"{space_id}-{i}" for i in np.argsort(-(vectors[space_id] @ query))[:k]}
+            for name, collection, where in (
+                ("global", global_collection, {"space_id": space_id}),
+                ("space", client.get_collection(f"space-{space_id}"), None),
+            ):
+                ids, elapsed = search(collection, query, k, where)
+                timings[name][0].append(elapsed)
+                timings[name][1].append(len(exact & set(ids)) / k)
+    return {name: summarize(latencies, recalls) for name, (latencies, recalls) in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark global filtered vs per-space collections.")
+    parser.add_argument("--spaces", nargs="+", type=int, default=[10, 100])
+    parser.add_argument("--vectors", type=int, default=500, help="vectors per space")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{args.vectors} vectors of {args.dim} dimensions per space, search_ef {settings.COLLECTION_METADATA['hnsw:search_ef']}")
+    print(f"{'spaces':>7} {'layout':<7} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(args.k):>10}")
+    for spaces in args.spaces:
+        results = run(spaces, args.vectors, args.dim, args.queries, args.k, rng)
+        for name, result in results.items():
+            print(f"{spaces:>7} {name:<7} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compares the pages/s of the PDF extraction backends on a corpus of PDFs.
+
+    python -m benchmarks.pdf_extraction <corpus dir> [--backends pypdf pymupdf] [--workers 1 4]
+
+Every backend reads every PDF of the corpus through app.pipeline.iter_pages, once per
+number of PDF_PARSE_WORKERS, so the page ranges are split exactly as during ingestion.
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import time
+
+from app.core.config import settings
+from app.pdf_extraction import EXTRACTORS
+from app import pipeline
+
+
+def run(files, backend: str, workers: int) -> dict:
+    settings.PDF_BACKEND = backend
+    settings.PDF_PARSE_WORKERS = workers
+    pipeline.get_page_pool.cache_clear()
+    if workers > 1:
+        # Starts the worker processes outside of the measured time
+        list(pipeline.ordered_map(pipeline.get_page_pool(), abs, [(0,)] * workers, workers))
+
+    pages = characters = 0
+    start = time.perf_counter()
+    for file_path in files:
+        for page in pipeline.iter_pages(file_path):
+            pages += 1
+            characters += len(page.page_content)
+    elapsed = time.perf_counter() - start
+
+    if workers > 1:
+        pipeline.get_page_pool().shutdown()
+    return {"pages": pages, "characters": characters, "seconds": elapsed, "pages_per_second": pages / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF extraction backends.")
+    parser.add_argument("corpus", help="directory of PDF files")
+    parser.add_argument("--backends", nargs="+", default=list(EXTRACTORS))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, settings.PDF_PARSE_WORKERS])
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.corpus, "**", "*.pdf"), recursive=True))
+    if not files:
+        parser.error(f"No PDF files in {args.corpus}")
+    print(f"{len(files)} files, {settings.PDF_PAGES_PER_TASK} pages per task")
+    print(f"{'backend':<10} {'workers':>7} {'pages':>7} {'chars':>10} {'seconds':>8} {'pages/s':>9}")
+    for backend in args.backends:
+        if importlib.util.find_spec(backend) is None:
+            print(f"{backend:<10} not installed")
+            continue
+        for workers in dict.fromkeys(args.workers):
+            result = run(files, backend, workers)
+            print(
+                f"{backend:<10} {workers:>7} {result['pages']:>7} {result['characters']:>10} "
+                f"{result['seconds']:>8.2f} {result['pages_per_second']:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
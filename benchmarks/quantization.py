@@ -0,0 +1,133 @@
+"""Compares the memory, recall and latency of the quantized exact search with HNSW and float32.
+
+    python -m benchmarks.quantization [--space-id 1 | --vectors 50000 --dim 1536] [--queries 200] [--k 15]
+
+Vectors are the stored vectors of a space, or synthetic clustered unit vectors. Queries are held
+out of the indexed vectors and their exact top k is the ground truth. Layouts:
+    - hnsw: the current Chroma layout, float32 vectors in an HNSW graph with COLLECTION_METADATA
+    - hnsw-{d}: with --ann-dimensions, the graph holds the first d dimensions and k * ANN_RESCORE
+      candidates are rescored with the full vectors
+    - exact: brute force over the float32 matrix
+    - exact-int8 / exact-binary: scan of the codes, rescoring of k * QUANTIZATION_RESCORE candidates
+      with the memory-mapped float32 rows
+Resident memory is what every search touches: the vectors and links of the graph, the float32 matrix,
+or only the codes for the quantized layouts, whose float32 rows stay on disk.
+"""
+import argparse
+import math
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings as ChromaSettings
+
+from app.core.config import settings
+from app.exact_search import QUANTIZERS, ExactIndex
+from app.matryoshka import truncate
+
+
+def synthetic(count: int, dim: int, rng) -> np.ndarray:
+    centers = rng.standard_normal((max(1, count // 500), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def hnsw_bytes(dim: int, m: int) -> float:
+    # hnswlib per element: vector, 2M level 0 links and their count, label, then upper levels
+    return dim * 4 + (2 * m + 1) * 4 + 8 + (m + 1) * 4 / math.log(m)
+
+
+def measure(search, queries: np.ndarray, expected: np.ndarray, k: int) -> dict:
+    latencies, recalls = [], []
+    for query, exact in zip(queries, expected):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(found) & set(exact.tolist())) / k)
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized exact search against HNSW.")
+    parser.add_argument("--space-id", type=int, help="use the stored vectors of a space")
+    parser.add_argument("--vectors", type=int, default=50000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--rescore", type=int, default=settings.QUANTIZATION_RESCORE)
+    parser.add_argument("--ann-dimensions", type=int, nargs="*", default=[], help="truncated HNSW layouts to add, e.g. 256 512")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.space_id is not None:
+        from app.search_params import stored_vectors
+
+        vectors = stored_vectors(args.space_id, args.vectors + args.queries)
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    else:
+        vectors = synthetic(args.vectors + args.queries, args.dim, rng)
+    order = rng.permutation(len(vectors))
+    queries, vectors = vectors[order[:args.queries]], vectors[order[args.queries:]]
+    dim = vectors.shape[1]
+    expected = np.argsort(-(queries @ vectors.T), axis=1, kind="stable")[:, :args.k]
+    ids = [str(i) for i in range(len(vectors))]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+        collection = client.create_collection("benchmark", embedding_function=None, metadata=settings.COLLECTION_METADATA)
+        for start in range(0, len(vectors), settings.CHROMA_BATCH_SIZE):
+            collection.add(ids=ids[start:start + settings.CHROMA_BATCH_SIZE], embeddings=vectors[start:start + settings.CHROMA_BATCH_SIZE])
+        results["hnsw"] = measure(
+            lambda query: [int(i) for i in collection.query(query_embeddings=[query], n_results=args.k, include=[])["ids"][0]],
+            queries, expected, args.k,
+        )
+        results["hnsw"]["resident"] = hnsw_bytes(dim, settings.COLLECTION_METADATA["hnsw:M"])
+        results["hnsw"]["disk"] = results["hnsw"]["resident"]
+
+        for dimensions in args.ann_dimensions:
+            truncated = client.create_collection(f"benchmark-{dimensions}", embedding_function=None, metadata=settings.COLLECTION_METADATA)
+            short = truncate(vectors, dimensions)
+            for start in range(0, len(vectors), settings.CHROMA_BATCH_SIZE):
+                truncated.add(ids=ids[start:start + settings.CHROMA_BATCH_SIZE], embeddings=short[start:start + settings.CHROMA_BATCH_SIZE])
+
+            def search(query):
+                candidates = truncated.query(
+                    query_embeddings=[truncate(query, dimensions)], n_results=args.k * settings.ANN_RESCORE, include=[]
+                )["ids"][0]
+                rows = np.array([int(i) for i in candidates])
+                return rows[np.argsort(-(vectors[rows] @ query), kind="stable")[:args.k]].tolist()
+
+            name = f"hnsw-{dimensions}"
+            results[name] = measure(search, queries, expected, args.k)
+            results[name]["resident"] = hnsw_bytes(dimensions, settings.COLLECTION_METADATA["hnsw:M"])
+            results[name]["disk"] = results[name]["resident"] + dim * 4
+
+        for name, quantizer in [("exact", None)] + [(f"exact-{name}", cls()) for name, cls in QUANTIZERS.items()]:
+            index = ExactIndex(f"{path}/{name}", len(vectors), quantizer, args.rescore)
+            index.write(0, ids, vectors, dim)
+            results[name] = measure(
+                lambda query: [int(chunk_id) for chunk_id, _ in index.search(0, [query], args.k)[1][0]],
+                queries, expected, args.k,
+            )
+            codes = quantizer.bytes_per_vector(dim) if quantizer else 0
+            results[name]["resident"] = codes or dim * 4
+            results[name]["disk"] = dim * 4 + codes
+
+    print(f"{len(vectors)} vectors of {dim} dimensions, {len(queries)} queries, rescoring {args.rescore} x k")
+    print(f"{'layout':<14} {'bytes/vec':>9} {'GB/1M RAM':>10} {'GB/1M disk':>11} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<14} {result['resident']:>9.0f} {result['resident'] * 1e6 / 1e9:>10.2f} {result['disk'] * 1e6 / 1e9:>11.2f} "
+            f"{result['recall']:>10.3f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
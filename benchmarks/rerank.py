@@ -0,0 +1,110 @@
+"""Compares the latency and quality of the rerankers on the questions of a space.
+
+    python -m benchmarks.rerank <questions.jsonl> --space-id 1 [--rerankers llm cross-encoder mmr] [--runtimes onnx torch-int8]
+
+Every line of the questions file is {"question": ..., "relevant": [...]} where the optional
+"relevant" lists substrings identifying the chunks that answer the question. Candidates are
+retrieved once per question and every reranker sees the same candidates. Reported per reranker:
+latency percentiles, hit@k and MRR against the labels when present, and the overlap of the
+top k with the LLM reranker, the current behaviour.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.rerank import CrossEncoderReranker, LLMReranker, MMRReranker
+from app.vectordb import vectordb
+
+
+def is_relevant(doc, relevant) -> bool:
+    text = doc.metadata.get("origin_content") or doc.page_content
+    return any(snippet in text for snippet in relevant)
+
+
+def evaluate(reranker, samples, k: int) -> dict:
+    latencies, rankings = [], []
+    for question, candidates, _ in samples:
+        start = time.perf_counter()
+        rankings.append(reranker.rerank(question, candidates, k))
+        latencies.append(time.perf_counter() - start)
+
+    hits, reciprocal_ranks = [], []
+    for (_, _, relevant), ranked in zip(samples, rankings):
+        if not relevant:
+            continue
+        ranks = [rank for rank, doc in enumerate(ranked, 1) if is_relevant(doc, relevant)]
+        hits.append(bool(ranks))
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "rankings": rankings,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean()),
+        f"hit@{k}": float(np.mean(hits)) if hits else None,
+        "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rerankers.")
+    parser.add_argument("questions", help="jsonl file of {question, relevant}")
+    parser.add_argument("--space-id", type=int, required=True)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=15)
+    parser.add_argument("--rerankers", nargs="+", default=["llm", "cross-encoder", "mmr"])
+    parser.add_argument("--runtimes", nargs="+", default=[settings.RERANK_RUNTIME],
+                        help="runtimes of the cross-encoder: onnx, torch, torch-int8")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    questions = [line["question"] for line in lines]
+    retrieved = vectordb.retrieve_many(questions, k=args.candidates, space_id=args.space_id)
+    samples = [
+        (line["question"], candidates, line.get("relevant") or [])
+        for line, candidates in zip(lines, retrieved)
+        if candidates
+    ]
+    print(f"{len(samples)} questions with candidates, top {args.k} of {args.candidates}")
+
+    rerankers = {}
+    for name in args.rerankers:
+        if name == "llm":
+            rerankers["llm"] = LLMReranker()
+        elif name == "mmr":
+            rerankers["mmr"] = MMRReranker(settings.RERANK_MMR_LAMBDA)
+        else:
+            for runtime in args.runtimes:
+                reranker = CrossEncoderReranker(settings.RERANK_MODEL, runtime)
+                # Loads the model outside of the measured time
+                reranker.score("warm up", ["warm up"])
+                rerankers[f"{name}/{runtime}"] = reranker
+
+    results = {name: evaluate(reranker, samples, args.k) for name, reranker in rerankers.items()}
+    reference = results.get("llm")
+
+    print(f"{'reranker':<26} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'hit@' + str(args.k):>7} {'mrr':>6} {'vs llm':>7}")
+    for name, result in results.items():
+        overlap = None
+        if reference:
+            overlap = np.mean([
+                len({doc.id for doc in ranked} & {doc.id for doc in expected}) / max(1, len(expected))
+                for ranked, expected in zip(result["rankings"], reference["rankings"])
+            ])
+        print(
+            f"{name:<26} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['mean_ms']:>8.1f} "
+            f"{format_metric(result[f'hit@{args.k}']):>7} {format_metric(result['mrr']):>6} {format_metric(overlap):>7}"
+        )
+
+
+def format_metric(value) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+if __name__ == "__main__":
+    main()
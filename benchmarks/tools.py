@@ -0,0 +1,80 @@
+"""Compares agent tool calls building their pipeline every time with calls through the tool registry.
+
+    python -m benchmarks.tools [--calls 50] [--question "..." --space-id 1]
+
+Without a question only the pipeline setup is measured: compiling the LangGraph graph and
+creating the ChatOpenAI clients (and the SQL tool) of RAG and RelationDB, which every tool call
+used to pay, against fetching the shared instance from the registry. With a question, the
+tools are invoked end to end (OpenAI calls included, the answer cache bypassed) both ways.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.query_relation_db import RelationDB
+from app.rag import RAG
+from app.tool_registry import ToolRegistry
+
+
+def summarize(latencies) -> dict:
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean()),
+    }
+
+
+def measure(calls: int, run) -> dict:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-call pipelines against the tool registry.")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--question", help="invoke the tools with this question")
+    parser.add_argument("--space-id", type=int, default=1)
+    args = parser.parse_args()
+
+    registry = ToolRegistry()
+    registry.register("rag", RAG)
+    registry.register("sql", RelationDB)
+    inputs = {
+        "rag": {"question": args.question, "space_id": args.space_id},
+        "sql": {"question": args.question},
+    }
+
+    results = {}
+    for name, builder in registry.builders.items():
+        if args.question:
+            cold = lambda: builder().graph.invoke(inputs[name])
+
+            def warm():
+                with registry.call(name) as pipeline:
+                    pipeline.graph.invoke(inputs[name])
+        else:
+            cold = builder
+
+            def warm():
+                with registry.call(name):
+                    pass
+        results[f"{name} per call"] = measure(args.calls, cold)
+        results[f"{name} registry"] = measure(args.calls, warm)
+
+    scope = "end-to-end calls" if args.question else "pipeline setup only"
+    print(f"{args.calls} calls per tool, {scope}")
+    print(f"{'tool':<14} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<14} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} {result['mean_ms']:>9.3f}")
+    for name, stats in registry.stats()["pipelines"].items():
+        print(f"{name}: built in {stats['build_ms']:.1f} ms, cold call {stats['cold_call_ms']:.1f} ms, warm p50 {stats['warm'].get('p50_ms', 0):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
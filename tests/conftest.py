@@ -0,0 +1,162 @@
+"""Fixtures of the ingestion tests: a temporary deployment, a fake embedder and a fake LLM.
+
+Settings are read when app.core.config is imported, so the environment points every store at
+a temporary directory before any app module is loaded. No test calls OpenAI.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+ROOT = tempfile.mkdtemp(prefix="rag-tests-")
+for name in ("pdf", "cache", "vectordb", "import"):
+    os.makedirs(os.path.join(ROOT, name))
+os.environ.update({
+    "OPENAI_API_KEY": "sk-test",
+    "DB_CONNECTION_STRING": f"sqlite:///{os.path.join(ROOT, 'db.sqlite3')}",
+    "PDF_DIR": os.path.join(ROOT, "pdf"),
+    "CACHE_DIR": os.path.join(ROOT, "cache"),
+    "VECTORDB_PERSIST_DIR": os.path.join(ROOT, "vectordb"),
+    "BULK_IMPORT_DIR": os.path.join(ROOT, "import"),
+    "COLLECTION_NAME": "tests",
+    "EMBEDDING_BATCH_SIZE": "4",
+    "CHROMA_BATCH_SIZE": "4",
+})
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(ROOT, ignore_errors=True)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by the text. Fails every call after `fail_after` calls."""
+
+    def __init__(self, dimensions: int = 64):
+        self.dimensions = dimensions
+        self.calls = 0
+        self.fail_after = None
+
+    def vector(self, text: str) -> list:
+        rng = np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+        vector = rng.standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        if self.fail_after is not None and self.calls >= self.fail_after:
+            raise RuntimeError("embedding service unavailable")
+        self.calls += 1
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+
+class FakeLLM:
+    """Contextualizer model answering every chunk with the same context."""
+
+    class Response:
+        content = "Context of the chunk."
+
+    async def ainvoke(self, messages):
+        return self.Response()
+
+
+def write_pdf(path: str, pages: list):
+    """Writes a minimal PDF with one line of Helvetica text per entry of every page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " ".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+@pytest.fixture(scope="session")
+def fake_embeddings():
+    from app import embedding_writer
+    from app.contextualizer import contextualizer
+    from app.embeddings import embeddings
+
+    fake = FakeEmbeddings()
+    embeddings.client = fake
+    contextualizer.llm = FakeLLM()
+    # Token counts use the offline estimate instead of downloading the tokenizer
+    embedding_writer.get_encoding = lambda: None
+    return fake
+
+
+@pytest.fixture(scope="session")
+def client(fake_embeddings):
+    from fastapi.testclient import TestClient
+
+    from app.api.main import app
+
+    client = TestClient(app)
+    client.post("/users/create", json={"username": "tester"})
+    client.post("/workspaces/create", json={"name": "tests", "owner_id": 1})
+    return client
+
+
+@pytest.fixture
+def embedder(fake_embeddings):
+    """The fake embedder with its failure injection reset after the test."""
+    yield fake_embeddings
+    fake_embeddings.fail_after = None
+
+
+@pytest.fixture
+def space(client, request) -> dict:
+    """A new space per test, so vector and document counts start from zero."""
+    response = client.post("/spaces/create", json={"name": request.node.name, "owner_id": 1, "workspace_id": 1})
+    return response.json()
+
+
+@pytest.fixture
+def make_pdf(tmp_path, request):
+    """Writes a PDF whose text is unique to the test and the given revision, returns its path."""
+    def make(revision: str = "a", pages: int = 3, directory=None) -> str:
+        path = os.path.join(directory or tmp_path, f"{revision}.pdf")
+        write_pdf(path, [
+            [f"{request.node.name} revision {revision} page {page} line {line} about quarterly results."
+             for line in range(40)]
+            for page in range(pages)
+        ])
+        return path
+    return make
+
+
+@pytest.fixture
+def wait(client):
+    """Polls a job until it completes or fails, returns its last status."""
+    def poll(url: str, timeout: float = 60) -> dict:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = client.get(url).json()
+            if job["status"] in ("completed", "failed"):
+                return job
+            time.sleep(0.05)
+        raise TimeoutError(url)
+    return poll
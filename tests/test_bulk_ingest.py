@@ -0,0 +1,45 @@
+import json
+import os
+
+from app.core.config import settings
+from app.db.document import DocumentsService
+from app.db.space import SpacesService
+from app.partitions import partitions
+
+
+def bulk_upload(client, space: dict, make_pdf, files: int) -> dict:
+    directory = f"bulk-{space['id']}"
+    os.makedirs(os.path.join(settings.BULK_IMPORT_DIR, directory))
+    for revision in range(files):
+        make_pdf(f"file{revision}", directory=os.path.join(settings.BULK_IMPORT_DIR, directory))
+    schema = json.dumps({"owner_id": 1, "workspace_id": 1, "space_id": space["id"]})
+    response = client.post("/documents/bulk", data={"document_schema": schema, "directory": directory})
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def documents(space: dict) -> list:
+    return [document.id for document in DocumentsService().get_all_documents() if document.space_id == space["id"]]
+
+
+def test_bulk_ingests_every_file(client, space, make_pdf, wait):
+    job = wait(f"/documents/bulk/{bulk_upload(client, space, make_pdf, 3)['id']}")
+
+    assert job["status"] == "completed", job["error"]
+    assert job["files_ingested"] == 3
+    assert len(documents(space)) == 3
+    assert SpacesService().get_space_by_id(space["id"]).num_documents == 3
+    assert partitions.count(space["id"]) > 0
+
+
+def test_failed_bulk_job_removes_its_documents(client, space, make_pdf, embedder, wait):
+    # The first embedding batch is written, the next one fails
+    embedder.fail_after = embedder.calls + 1
+
+    job = wait(f"/documents/bulk/{bulk_upload(client, space, make_pdf, 3)['id']}")
+
+    assert job["status"] == "failed"
+    assert job["documents_created"] == 0
+    assert documents(space) == []
+    assert SpacesService().get_space_by_id(space["id"]).num_documents == 0
+    assert partitions.count(space["id"]) == 0
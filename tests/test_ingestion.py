@@ -0,0 +1,127 @@
+import json
+
+from app.db.document import DocumentsService
+from app.db.document_chunk import DocumentChunksService
+from app.db.space import SpacesService
+from app.partitions import partitions
+
+
+def upload(client, path: str, space: dict, name: str = "report.pdf") -> dict:
+    schema = json.dumps({"owner_id": 1, "workspace_id": 1, "space_id": space["id"]})
+    with open(path, "rb") as f:
+        response = client.post(
+            "/documents/upload", files={"file": (name, f, "application/pdf")}, data={"document_schema": schema}
+        )
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def replace(client, document_id: int, path: str, name: str = "revision.pdf") -> dict:
+    with open(path, "rb") as f:
+        response = client.put(f"/documents/{document_id}", files={"file": (name, f, "application/pdf")})
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def vector_ids(space: dict, document_id: int) -> set:
+    collection = partitions.collection(space["id"])
+    return set(collection.get(where={"document_id": document_id}, include=[])["ids"])
+
+
+def document_file(document_id: int) -> tuple:
+    document = DocumentsService().get_document_by_id(document_id)
+    return document.title, document.content_hash
+
+
+def num_documents(space: dict) -> int:
+    return SpacesService().get_space_by_id(space["id"]).num_documents
+
+
+def test_upload_embeds_and_registers_every_chunk(client, space, make_pdf, wait):
+    job = wait(f"/documents/jobs/{upload(client, make_pdf(), space)['id']}")
+
+    assert job["status"] == "completed", job["error"]
+    assert job["vectors_written"] > 0
+    ids = vector_ids(space, job["document_id"])
+    assert len(ids) == job["vectors_written"]
+    assert {chunk.chunk_id for chunk in DocumentChunksService().get_chunks(job["document_id"])} == ids
+    assert num_documents(space) == 1
+
+
+def test_duplicate_upload_copies_the_vectors(client, space, make_pdf, embedder, wait):
+    path = make_pdf()
+    first = wait(f"/documents/jobs/{upload(client, path, space)['id']}")
+    calls = embedder.calls
+
+    second = wait(f"/documents/jobs/{upload(client, path, space, 'copy.pdf')['id']}")
+
+    assert second["status"] == "completed", second["error"]
+    assert second["source_document_id"] == first["document_id"]
+    assert embedder.calls == calls
+    assert len(vector_ids(space, second["document_id"])) == len(vector_ids(space, first["document_id"]))
+
+
+def test_failed_upload_removes_its_partial_vectors(client, space, make_pdf, embedder, wait):
+    # The first embedding batch is written, the next one fails
+    embedder.fail_after = embedder.calls + 1
+
+    job = wait(f"/documents/jobs/{upload(client, make_pdf(pages=4), space)['id']}")
+
+    assert job["status"] == "failed"
+    assert "embedding service unavailable" in job["error"]
+    assert vector_ids(space, job["document_id"]) == set()
+
+
+def test_replace_with_the_same_file_reuses_every_chunk(client, space, make_pdf, embedder, wait):
+    path = make_pdf()
+    job = wait(f"/documents/jobs/{upload(client, path, space)['id']}")
+    ids = vector_ids(space, job["document_id"])
+    calls = embedder.calls
+
+    replaced = wait(f"/documents/jobs/{replace(client, job['document_id'], path)['id']}")
+
+    assert replaced["status"] == "completed", replaced["error"]
+    assert replaced["chunks_reused"] == len(ids)
+    assert embedder.calls == calls
+    assert vector_ids(space, job["document_id"]) == ids
+
+
+def test_replace_updates_the_file_once_ingested(client, space, make_pdf, wait):
+    job = wait(f"/documents/jobs/{upload(client, make_pdf('a'), space)['id']}")
+    ids = vector_ids(space, job["document_id"])
+    _, old_hash = document_file(job["document_id"])
+
+    replaced = wait(f"/documents/jobs/{replace(client, job['document_id'], make_pdf('b', pages=2))['id']}")
+
+    assert replaced["status"] == "completed", replaced["error"]
+    title, content_hash = document_file(job["document_id"])
+    assert title == "revision.pdf"
+    assert content_hash != old_hash
+    new_ids = vector_ids(space, job["document_id"])
+    assert new_ids and not new_ids & ids
+
+
+def test_failed_replace_keeps_the_previous_revision(client, space, make_pdf, embedder, wait):
+    job = wait(f"/documents/jobs/{upload(client, make_pdf('a'), space)['id']}")
+    ids = vector_ids(space, job["document_id"])
+    before = document_file(job["document_id"])
+    embedder.fail_after = embedder.calls + 1
+
+    replaced = wait(f"/documents/jobs/{replace(client, job['document_id'], make_pdf('b', pages=4))['id']}")
+
+    assert replaced["status"] == "failed"
+    assert document_file(job["document_id"]) == before
+    assert vector_ids(space, job["document_id"]) == ids
+
+
+def test_delete_removes_the_document_and_its_vectors(client, space, make_pdf, wait):
+    job = wait(f"/documents/jobs/{upload(client, make_pdf(), space)['id']}")
+    assert vector_ids(space, job["document_id"])
+
+    response = client.delete(f"/documents/{job['document_id']}")
+
+    assert response.status_code == 204
+    assert vector_ids(space, job["document_id"]) == set()
+    assert DocumentChunksService().get_chunks(job["document_id"]) == []
+    assert num_documents(space) == 0
+    assert client.delete(f"/documents/{job['document_id']}").status_code == 404